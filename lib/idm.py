@@ -11,25 +11,451 @@
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.urls import fetch_url
 from ansible.module_utils.six.moves.urllib.parse import urlencode
+from ansible.module_utils.six.moves import http_client
+from concurrent.futures import ThreadPoolExecutor
 from dictdiffer import diff
+import hashlib
 import json
+try:
+  import ijson
+except ImportError:
+  ijson = None
+import socket
+import sqlite3
+import threading
+
+# statuses with which the server refuses a bulk request before applying any of it
+BULK_UNSUPPORTED_STATUS = (400, 404, 405, 415)
+
+# methods sent again when the reused connection is closed before the response
+RETRY_METHODS = ('GET',)
+
+class IDMError(Exception):
+  def __init__(self, status, message):
+    self.status = status
+    super(IDMError, self).__init__(message)
+
+class IDMConnectionPool:
+  def __init__(self, host, port, timeout = 30):
+    self.host = host
+    self.port = port
+    self.timeout = timeout
+    self.local = threading.local()
+    self.lock = threading.Lock()
+    self.connections = []
+
+  def request(self, method, path, body, headers):
+    # each worker thread keeps its own keep-alive connection
+    connection = getattr(self.local, 'connection', None)
+    reused = connection is not None
+    if not reused:
+      connection = self.connect()
+    try:
+      connection.request(method, path, body=body.encode('utf-8') if body else None, headers=headers)
+    except (http_client.HTTPException, socket.error):
+      connection.close()
+      if not reused:
+        raise
+      # the request could not be sent over the idle keep-alive connection, send it on a fresh one
+      return self.send(self.connect(), method, path, body, headers)
+    try:
+      return connection.getresponse()
+    except socket.timeout:
+      # the server may be processing the request, never send it again
+      connection.close()
+      raise
+    except (http_client.HTTPException, socket.error):
+      connection.close()
+      if not reused or method not in RETRY_METHODS:
+        raise
+      # the server closed the idle keep-alive connection, only a read is safe to send again
+      return self.send(self.connect(), method, path, body, headers)
+
+  def send(self, connection, method, path, body, headers):
+    connection.request(method, path, body=body.encode('utf-8') if body else None, headers=headers)
+    return connection.getresponse()
+
+  def connect(self):
+    connection = http_client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+    self.local.connection = connection
+    with self.lock:
+      self.connections.append(connection)
+    return connection
+
+  def close(self):
+    with self.lock:
+      for connection in self.connections:
+        connection.close()
+      self.connections = []
+
+class IDMSnapshotCache:
+  def __init__(self, path, interface, params):
+    # changes are written in one short transaction by close, so that interfaces sharing the cache file
+    # do not wait for each other while their instances are read from the IDM
+    self.connection = sqlite3.connect(path, timeout=600)
+    # instances read with another filter or projection are kept apart
+    self.scope = json.dumps([interface, params.get('_filter'), params.get('_properties')])
+    self.cleared = False
+    self.rows = []
+    self.stale_keys = []
+    self.updated = 0
+    self.connection.execute('CREATE TABLE IF NOT EXISTS instances (scope TEXT, key TEXT, csn, digest TEXT, instance TEXT,'
+      ' PRIMARY KEY (scope, key))')
+
+  def last_csn(self):
+    return self.connection.execute('SELECT MAX(csn) FROM instances WHERE scope = ?', (self.scope,)).fetchone()[0]
+
+  def put(self, key, csn, digest, instance):
+    self.rows.append((self.scope, json.dumps(key), csn, digest, json.dumps(instance, ensure_ascii=False)))
+    self.updated += 1
+
+  def load(self, live_keys, with_instance):
+    # yield cached instances whose key still exists, forget the others
+    for key_text, csn, digest, instance in self.connection.execute(
+        'SELECT key, csn, digest, instance FROM instances WHERE scope = ?', (self.scope,)):
+      key = json.loads(key_text)
+      if key not in live_keys:
+        self.stale_keys.append((self.scope, key_text))
+        continue
+      yield key, csn, digest, json.loads(instance) if with_instance else None
+
+  def clear(self):
+    self.cleared = True
+    self.rows = []
+    self.stale_keys = []
+    self.updated = 0
+
+  def close(self, commit):
+    try:
+      if commit:
+        with self.connection:
+          if self.cleared:
+            self.connection.execute('DELETE FROM instances WHERE scope = ?', (self.scope,))
+          self.connection.executemany('DELETE FROM instances WHERE scope = ? AND key = ?', self.stale_keys)
+          self.connection.executemany('INSERT OR REPLACE INTO instances VALUES (?, ?, ?, ?, ?)', self.rows)
+    finally:
+      self.connection.close()
+
+class IDMInterface:
+  def __init__(self, module, spec):
+    self.module = module
+    self.params = spec
+    self.deleted_list = []
+    self.updated_list = []
+    self.added_list = []
+    self.results = {}
+    self.diff_list = []
+
+  def process(self, parallelism):
+    module = self.module
+    params = {}
+    if self.params['filter']:
+      params['_filter'] = module.jsonify(self.params['filter'])
+    if self.params['properties']:
+      params['_properties'] = ','.join(self.params['properties'])
+    key_property = self.params['key_property']
+
+    if self.params['apply_plan']:
+      operations = self.load_plan(params)
+      self.apply_operations(params, operations, parallelism)
+      return
+
+    try:
+      if self.params['snapshot_cache']:
+        before_map = self.load_cached_before_map(params)
+      else:
+        before_map = self.load_before_map(params)
+    except Exception as e:
+      raise Exception("Fail to get before values: {0}".format(e))
+
+    state = self.params['state']
+    operations = []
+    for target in self.params['instances']:
+      if key_property not in target:
+        raise Exception('Instance {0} does not have key property {1}'.format(module.jsonify(target), key_property))
+      key =  target[key_property]
+      if key in before_map:
+        digest, before, csn = before_map.pop(key)
+        if state == 'absent':
+          action = 'delete "{0}" from {1}'.format(key, self.params['interface'])
+          operations.append(('DELETE', key, None, action, csn))
+        elif state == 'update' and _digest(target) != digest:
+          action = 'update "{0}" in {1}'.format(key, self.params['interface'])
+          if before is not None:
+            action += ' for differrnece {0}'.format(str(list(diff(target, before))))
+            if module._diff:
+              self.diff_list.append(dict(before_header=str(key), after_header=str(key), before=before, after=target))
+          operations.append(('PUT', key, target, action, csn))
+      elif state != 'absent':
+        action = 'add "{0}" into {1} as {2}'.format(
+          key, self.params['interface'], json.dumps(target, ensure_ascii=False))
+        operations.append(('POST', key, target, action, None))
+    if before_map and self.params['delete_orphands'] and state != 'absent' :
+      for key in before_map:
+        action = 'delete orphand "{0}" from {1}'.format(key, self.params['interface'])
+        operations.append(('DELETE', key, None, action, before_map[key][2]))
+
+    if self.params['plan_file'] and module.check_mode:
+      self.save_plan(operations)
+    self.apply_operations(params, operations, parallelism)
+
+  def save_plan(self, operations):
+    plan = dict(
+      interface=self.params['interface'],
+      key_property=self.params['key_property'],
+      filter=self.params['filter'],
+      properties=self.params['properties'],
+      operations=[dict(method=method, key=key, data=data, action=action, before_csn=csn)
+        for method, key, data, action, csn in operations])
+    with open(self.params['plan_file'], 'w') as f:
+      json.dump(plan, f, ensure_ascii=False)
+    self.module.debug('Save change plan of {0} operations into {1}'.format(len(operations), self.params['plan_file']))
+
+  def load_plan(self, params):
+    # apply the plan saved by a check mode run without reading and comparing all instances again,
+    # only the keys and _csn are read to make sure that nothing changed in the meantime
+    try:
+      with open(self.params['plan_file']) as f:
+        plan = json.load(f)
+    except Exception as e:
+      raise Exception('Fail to read change plan {0}: {1}'.format(self.params['plan_file'], e))
+    for name in ('interface', 'key_property', 'filter', 'properties'):
+      if plan.get(name) != self.params[name]:
+        raise Exception('Change plan {0} is made for {1}={2}, not for {3}'.format(
+          self.params['plan_file'], name, plan.get(name), self.params[name]))
+    key_params = dict(params)
+    key_params['_properties'] = self.params['key_property']
+    try:
+      csn_map = dict((self.before_key(instance), instance.get('_csn')) for instance in self.iter_idm(key_params))
+    except Exception as e:
+      raise Exception("Fail to get current _csn values: {0}".format(e))
+    operations = []
+    conflicts = []
+    for operation in plan['operations']:
+      key = operation['key']
+      if operation['method'] == 'POST':
+        if key in csn_map:
+          conflicts.append(key)
+      elif key not in csn_map or csn_map[key] != operation['before_csn']:
+        conflicts.append(key)
+      operations.append((operation['method'], key, operation['data'], operation['action'], operation['before_csn']))
+    if conflicts:
+      raise Exception('Change plan {0} is out of date, instances {1} of {2} are changed after the plan is made'.format(
+        self.params['plan_file'], self.module.jsonify(conflicts), self.params['interface']))
+    return operations
+
+  def before_key(self, instance):
+    key_property = self.params['key_property']
+    if key_property not in instance:
+      raise Exception('Instance {0} from the interface {1} does not have key property {2}, {3}, {4}'.format(
+        self.module.jsonify(instance), self.params['interface'], key_property, type(instance), instance))
+    return instance[key_property]
+
+  def iter_idm(self, params):
+    return self.module.iter_idm(params, interface = self.params['interface'])
+
+  def load_before_map(self, params):
+    # keep the before instances only when a diff has to be shown,
+    # otherwise unchanged instances are detected by comparing digests
+    keep_before = self.module._diff or self.module._debug
+    before_map = {}
+    for target in self.iter_idm(params):
+      key = self.before_key(target)
+      csn = target.pop('_csn', None)
+      before_map[key] = (_digest(target), target if keep_before else None, csn)
+    return before_map
+
+  def load_cached_before_map(self, params):
+    keep_before = self.module._diff or self.module._debug
+    cache = IDMSnapshotCache(self.params['snapshot_cache'], self.params['interface'], params)
+    success = False
+    try:
+      before_map = {}
+      last_csn = cache.last_csn()
+      if last_csn is not None:
+        # list the current keys, then fetch only the instances changed since the last seen _csn
+        key_params = dict(params)
+        key_params['_properties'] = self.params['key_property']
+        live_keys = set(self.before_key(instance) for instance in self.iter_idm(key_params))
+        delta_filter = {'_csn': {'$gt': last_csn}}
+        if self.params['filter']:
+          delta_filter = {'$and': [self.params['filter'], delta_filter]}
+        delta_params = dict(params)
+        delta_params['_filter'] = self.module.jsonify(delta_filter)
+        for target in self.iter_idm(delta_params):
+          key = self.before_key(target)
+          csn = target.pop('_csn', None)
+          digest = _digest(target)
+          cache.put(key, csn, digest, target)
+          before_map[key] = (digest, target if keep_before else None, csn)
+        for key, csn, digest, target in cache.load(live_keys, keep_before):
+          if key not in before_map:
+            before_map[key] = (digest, target, csn)
+        if live_keys.issubset(before_map):
+          self.module.debug('Use snapshot cache for {0} with {1} instances changed since _csn {2}'.format(
+            self.params['interface'], cache.updated, last_csn))
+          success = True
+          return before_map
+        self.module.debug('Snapshot cache for {0} is incomplete, fetch all instances'.format(self.params['interface']))
+      cache.clear()
+      before_map = {}
+      for target in self.iter_idm(params):
+        key = self.before_key(target)
+        csn = target.pop('_csn', None)
+        digest = _digest(target)
+        cache.put(key, csn, digest, target)
+        before_map[key] = (digest, target if keep_before else None, csn)
+      success = True
+      return before_map
+    finally:
+      # a partially read delta must not advance the last seen _csn
+      cache.close(success)
+
+  def apply_operations(self, params, operations, parallelism):
+    module = self.module
+    if module.check_mode:
+      for method, key, data, action, csn in operations:
+        module.debug('Success to {0} check_mode={2} result={1}'.format(action, module.check_mode, 0))
+        self.record_result(method, key, 0)
+      return
+
+    batch_size = module.params['batch_size']
+    if batch_size > 1:
+      # send adds, updates and deletes as chunked bulk requests, each chunk carries
+      # a JSON array of instances (or keys for DELETE) to the bulk endpoint of the interface
+      units = []
+      for method in ('POST', 'PUT', 'DELETE'):
+        chunk = [operation for operation in operations if operation[0] == method]
+        units.extend([chunk[index:index + batch_size] for index in range(0, len(chunk), batch_size)])
+      execute = self.execute_batch
+    else:
+      units = operations
+      execute = self.execute_operation
+    self.bulk_rejected = set()
+
+    if parallelism <= 1:
+      for unit in units:
+        for operation, result in execute(params, unit):
+          self.record_result(operation[0], operation[1], result)
+      return
+
+    # dispatch mutations through a bounded worker pool over keep-alive connections,
+    # results are recorded in submission order so that the lists are deterministic
+    executor = ThreadPoolExecutor(max_workers=parallelism)
+    futures = [executor.submit(execute, params, unit) for unit in units]
+    try:
+      for future in futures:
+        for operation, result in future.result():
+          self.record_result(operation[0], operation[1], result)
+    finally:
+      for future in futures:
+        future.cancel()
+      executor.shutdown(wait=True)
+
+  def execute_operation(self, params, operation):
+    method, key, data, action, csn = operation
+    interface = self.params['interface']
+    try:
+      if method == 'POST':
+        result = self.module.call_idm(params, method = method, data = data, interface = interface)
+      else:
+        result = self.module.call_idm(params, method = method, key = key, data = data, interface = interface)
+    except Exception as e:
+      raise Exception("Fail to {0}: {1}".format(action, e))
+    self.module.debug('Success to {0} check_mode={2} result={1}'.format(action, self.module.check_mode, result))
+    return [(operation, result)]
+
+  def execute_batch(self, params, batch):
+    method = batch[0][0]
+    if method not in self.bulk_rejected:
+      if method == 'DELETE':
+        data = [operation[1] for operation in batch]
+      else:
+        data = [operation[2] for operation in batch]
+      try:
+        results = self.module.call_idm({}, method = method, key = self.module.params['bulk_endpoint'], data = data,
+          interface = self.params['interface'])
+      except IDMError as e:
+        if e.status not in BULK_UNSUPPORTED_STATUS:
+          raise Exception("Fail to bulk {0} {1} instances: {2}".format(method, len(batch), e))
+        # refused before anything is applied, so the instances can be sent one by one
+        self.module.debug('Bulk {0} of {1} instances into {2} is rejected, fall back to per instance calls: {3}'.format(
+          method, len(batch), self.params['interface'], e))
+        self.bulk_rejected.add(method)
+      else:
+        if not isinstance(results, list) or len(results) != len(batch):
+          # the chunk may be applied already, replaying it per instance is not safe
+          raise Exception('Unexpected response of bulk {0} for {1} instances: {2}'.format(
+            method, len(batch), self.module.jsonify(results)))
+        for operation, result in zip(batch, results):
+          self.module.debug('Success to {0} check_mode={2} result={1}'.format(operation[3], self.module.check_mode, result))
+        return list(zip(batch, results))
+    results = []
+    for operation in batch:
+      results.extend(self.execute_operation(params, operation))
+    return results
+
+  def record_result(self, method, key, result):
+    if method == 'POST':
+      self.added_list.append(key)
+    elif method == 'PUT':
+      self.updated_list.append(key)
+    else:
+      self.deleted_list.append(key)
+    if self.module.params['batch_size'] > 1:
+      self.results[key] = result
+
+  def changed(self):
+    return len(self.deleted_list) > 0 or len(self.updated_list) > 0 or len(self.added_list) > 0
+
+  def result(self):
+    result = dict(changed=self.changed(),
+      added_list=self.added_list, updated_list=self.updated_list, deleted_list=self.deleted_list)
+    if self.module.params['batch_size'] > 1:
+      result['results'] = self.results
+    return result
 
 class IDM(AnsibleModule):
   def __init__(self):
     argument_spec = dict(
-      interface=dict(required=True),
+      interface=dict(required=False),
+      interfaces=dict(required=False,type='list',elements='dict',options=dict(
+        interface=dict(required=True),
+        filter=dict(required=False,type='dict'),
+        properties=dict(required=False,type='list',elements='str'),
+        instances=dict(required=True,type='list',elements='dict'),
+        key_property=dict(required=True),
+        delete_orphands=dict(required=False,type='bool'),
+        state=dict(required=False,choices=['absent', 'present', 'update']),
+        snapshot_cache=dict(required=False,type='path'),
+        plan_file=dict(required=False,type='path'),
+        apply_plan=dict(required=False,type='bool')
+      )),
       host=dict(required=False,default='localhost'),
       port=dict(required=False,type='int',default=8090),
       system_account=dict(required=False,default='IDM_AUTO_BUILDER'),
       filter=dict(required=False,type='dict'),
       properties=dict(required=False,type='list',elements='str'),
-      instances=dict(required=True,type='list',elements='dict'),
-      key_property=dict(required=True),
+      page_size=dict(required=False,type='int',default=0),
+      snapshot_cache=dict(required=False,type='path'),
+      plan_file=dict(required=False,type='path'),
+      apply_plan=dict(required=False,type='bool',default=False),
+      instances=dict(required=False,type='list',elements='dict'),
+      key_property=dict(required=False),
       delete_orphands=dict(required=False,type='bool',default=True),
+      batch_size=dict(required=False,type='int',default=1),
+      bulk_endpoint=dict(required=False),
+      parallelism=dict(required=False,type='int',default=1),
       state=dict(required=False,default='update', choices=['absent', 'present', 'update'])
     )
-    super(IDM, self).__init__(argument_spec=argument_spec, supports_check_mode=True)
+    super(IDM, self).__init__(argument_spec=argument_spec, supports_check_mode=True,
+      required_one_of=[('interface', 'interfaces')],
+      mutually_exclusive=[('interface', 'interfaces'), ('plan_file', 'interfaces')],
+      required_by={'interface': ('instances', 'key_property')},
+      required_if=[('apply_plan', True, ['plan_file'])])
     self.changed = False
+    self.connection_pool = None
+    self.tasks = []
 
   def __enter__(self):
     pass
@@ -37,121 +463,133 @@ class IDM(AnsibleModule):
   def __exit__(self, exc_type, exc_value, traceback):
     self.debug("Enter exit handler exc_value={0}".format(exc_value))
     if not self.check_mode:
-      try:
-        interface = '_currentSandboxProvRequestsUser'
-        if self.params['interface'].startswith('_'):
-          interface = '_currentRepositorySandboxProvRequestsUser'
-        response = self.call_idm({}, interface = interface, key= self.params['system_account'])
-        if not response:
-          self.debug("No provisioning Request found for {0}.".format(self.params['system_account']))
-          return
-        request_id = response[0]['id']
-      except Exception as e:
-        msg = "Fail to get provisiong request for {0}: {1}".format(self.params['system_account'], e)
-        if exc_value:
-          msg = "Error: {0} and {1}".format(exc_value, msg)
-        raise Exception(msg)
-      self.debug("Success to get provisiong request for {0} id= {1}".format(self.params['system_account'], request_id))
-      try:
-        data={'requestId': request_id}
-        if exc_value:
-          data['cancel'] = True
-        response = self.call_idm({}, method='POST', interface = '_editingCompletedEvents', data = data)
-      except Exception as e:
-        msg = "Fail to commit/cancel provisiong request {0}: {1}".format(data, e)
-        if exc_value:
-          msg = "Error: {0} and {1}".format(exc_value, msg)
-        raise Exception(msg)
-      self.debug("Success to commit/cancel provisiong request {0}".format(data))
+      # the changes on the interfaces whose name starts with '_' belong to the repository request
+      request_interfaces = set()
+      for task in self.tasks:
+        if task.params['interface'].startswith('_'):
+          request_interfaces.add('_currentRepositorySandboxProvRequestsUser')
+        else:
+          request_interfaces.add('_currentSandboxProvRequestsUser')
+      for interface in sorted(request_interfaces):
+        self.complete_request(interface, exc_value)
       if exc_value:
         # success to cancel any change
         self.changed = False
 
+  def complete_request(self, interface, exc_value):
+    try:
+      response = self.call_idm({}, interface = interface, key= self.params['system_account'])
+      if not response:
+        self.debug("No provisioning Request found for {0}.".format(self.params['system_account']))
+        return
+      request_id = response[0]['id']
+    except Exception as e:
+      msg = "Fail to get provisiong request for {0}: {1}".format(self.params['system_account'], e)
+      if exc_value:
+        msg = "Error: {0} and {1}".format(exc_value, msg)
+      raise Exception(msg)
+    self.debug("Success to get provisiong request for {0} id= {1}".format(self.params['system_account'], request_id))
+    try:
+      data={'requestId': request_id}
+      if exc_value:
+        data['cancel'] = True
+      response = self.call_idm({}, method='POST', interface = '_editingCompletedEvents', data = data)
+    except Exception as e:
+      msg = "Fail to commit/cancel provisiong request {0}: {1}".format(data, e)
+      if exc_value:
+        msg = "Error: {0} and {1}".format(exc_value, msg)
+      raise Exception(msg)
+    self.debug("Success to commit/cancel provisiong request {0}".format(data))
+
   def process_task(module):
-    params = {}
-    if module.params['filter']:
-      params['_filter'] = module.jsonify(module.params['filter'])
-    if module.params['properties']:
-      params['_properties'] = ','.join(module.params['properties'])
     module.params['validate_certs'] = False
-    key_property = module.params['key_property']
+    if module.params['batch_size'] > 1 and not module.params['bulk_endpoint']:
+      # the bulk requests are sent only to an endpoint known to accept JSON arrays
+      raise Exception('bulk_endpoint is required when batch_size is more than 1')
+    names = ('interface', 'filter', 'properties', 'instances', 'key_property', 'delete_orphands', 'state',
+      'snapshot_cache', 'plan_file', 'apply_plan')
+    if module.params['interfaces']:
+      for item in module.params['interfaces']:
+        # options not given for the interface are taken from the module parameters
+        spec = dict((name, module.params[name] if item.get(name) is None else item[name]) for name in names)
+        for name in ('filter', 'properties', 'plan_file'):
+          spec[name] = item.get(name)
+        module.tasks.append(IDMInterface(module, spec))
+    else:
+      module.tasks.append(IDMInterface(module, dict((name, module.params[name]) for name in names)))
 
+    parallelism = module.params['parallelism']
+    if parallelism > 1:
+      module.connection_pool = IDMConnectionPool(module.params['host'], module.params['port'])
     try:
-      before_instances = module.call_idm(params)
-    except Exception as e:
-      raise Exception("Fail to get before values: {0}".format(e))
+      if len(module.tasks) == 1:
+        module.tasks[0].process(parallelism)
+        return
+      # reconcile the interfaces side by side over the shared connection pool,
+      # the mutations of each interface are sent in order
+      executor = ThreadPoolExecutor(max_workers=max(parallelism, 1))
+      futures = [executor.submit(task.process, 1) for task in module.tasks]
+      try:
+        for future in futures:
+          future.result()
+      finally:
+        for future in futures:
+          future.cancel()
+        executor.shutdown(wait=True)
+    finally:
+      if module.connection_pool:
+        module.connection_pool.close()
+        module.connection_pool = None
 
-    before_map = {}
-    for target in before_instances:
-      if key_property not in  target:
-        raise Exception('Instance {0} from the interface {1} does not have key property {2}, {3}, {4}'.format(
-          module.jsonify(target), module.params['interface'], key_property, type(target), target))
-      target.pop('_csn', None)
-      before_map[target[key_property]] = target
-
-    state = module.params['state']
-    module.deleted_list = []
-    module.updated_list = []
-    module.added_list = []
-    for target in module.params['instances']:
-      if key_property not in target:
-        raise Exception('Instance {0} does not have key property {1}'.format(module.jsonify(target), key_property))
-      key =  target[key_property]
-      if key in before_map:
-        before = before_map.pop(key)
-        if state == 'absent':
-          action = 'delete "{0}" from {1}'.format(key, module.params['interface'])
-          result = 0
-          if not module.check_mode:
-            try:
-              result = module.call_idm(params, method = 'DELETE', key = key)
-            except Exception as e:
-              raise Exception("Fail to {0}: {1}".format(action, e))
-          module.debug('Success to {0} check_mode={2} result={1}'.format(action, module.check_mode, result))
-          module.deleted_list.append(key)
-        elif state == 'update' and target != before:
-          diff_result = diff(target, before)
-          action = 'update "{0}" in {1} for differrnece {2}'.format(
-            key, module.params['interface'], str(list(diff_result)))
-          result = 0
-          if not module.check_mode:
-            try:
-              result = module.call_idm(params, method = 'PUT', key = key, data = target)
-            except Exception as e:
-              raise Exception("Fail to {0}: {1}".format(action, e))
-          module.debug('Success to {0} check_mode={2} result={1}'.format(action, module.check_mode, result))
-          module.updated_list.append(key)
-      elif state != 'absent':
-        action = 'add "{0}" into {1} as {2}'.format(
-          key, module.params['interface'], json.dumps(target, ensure_ascii=False))
-        result = 0
-        if not module.check_mode:
-          try:
-            result = module.call_idm(params, method = 'POST', data = target)
-          except Exception as e:
-            raise Exception("Fail to {0}: {1}".format(action, e))
-          module.debug('Success to {0} check_mode={2} result={1}'.format(action, module.check_mode, result))
-        module.added_list.append(key)
-    if before_map and module.params['delete_orphands'] and state != 'absent' :
-      for key in before_map:
-        action = 'delete orphand "{0}" from {1}'.format(key, module.params['interface'])
-        result = 0
-        if not module.check_mode:
-          try:
-            result = module.call_idm(params, method = 'DELETE', key = key)
-          except Exception as e:
-            raise Exception("Fail to {0}: {1}".format(action, e))
-        module.debug('Success to {0} check_mode={2} result={1}'.format(action, module.check_mode, result))
-        module.deleted_list.append(key)
-
-  def call_idm(module, params, method = 'GET', key = '', data = {}, interface = ''):
+  def iter_idm(module, params, interface = ''):
+    # read the interface page by page with _offset/_limit, so that only one page
+    # of instances is held in memory at a time
+    page_size = module.params['page_size']
+    if page_size <= 0:
+      for instance in module.stream_idm(params, interface):
+        yield instance
+      return
+    offset = 0
+    # an interface ignoring _offset/_limit would make the loop endless
+    page_heads = set()
+    while True:
+      page_params = dict(params)
+      page_params['_offset'] = offset
+      page_params['_limit'] = page_size
+      count = 0
+      for instance in module.stream_idm(page_params, interface):
+        if count == 0:
+          head = json.dumps(instance, sort_keys=True)
+          if head in page_heads:
+            raise Exception('The interface returned the same page again at _offset={0}, _offset may not be supported'.format(offset))
+          page_heads.add(head)
+        count += 1
+        if count > page_size:
+          raise Exception('The interface returned more than {0} instances at _offset={1}, _limit may not be supported'.format(page_size, offset))
+        yield instance
+      if count < page_size:
+        return
+      offset += count
+
+  def stream_idm(module, params, interface = ''):
+    response = module.call_idm(params, interface = interface, stream = True)
+    if ijson is None:
+      for instance in json.loads(response.read()):
+        yield instance
+    else:
+      for instance in ijson.items(response, 'item', use_float=True):
+        yield instance
+      # drain the rest of the body so that a keep-alive connection can be reused
+      response.read()
+
+  def call_idm(module, params, method = 'GET', key = '', data = {}, interface = '', stream = False):
     if not interface:
       interface = module.params['interface']
-    url = 'http://' + module.params['host'] + ':' + str(module.params['port']) + '/IDManager/' + interface
+    path = '/IDManager/' + interface
     if key:
-      url += '/' + str(key)
+      path += '/' + str(key)
     if params :
-      url += '?' + urlencode(params)
+      path += '?' + urlencode(params)
 
     headers = {'Accept': 'application/json charset=utf-8', 'HTTP_SYSTEMACCOUNT': module.params['system_account']}
     datastr = ''
@@ -159,7 +597,17 @@ class IDM(AnsibleModule):
       headers['Content-Type'] = 'application/json'
       datastr = json.dumps(data, ensure_ascii=False)
       module.debug("call idm with body: " + datastr)
+    if module.connection_pool:
+      response = module.connection_pool.request(method, path, datastr, headers)
+      if response.status != 200:
+        raise IDMError(response.status, 'Failed to execute the API request: {0}: {1}'.format(response.reason, response.read().decode()))
+      if stream:
+        return response
+      return json.loads(response.read())
+    url = 'http://' + module.params['host'] + ':' + str(module.params['port']) + path
     response, info = fetch_url(module, url, method=method, headers=headers, data=datastr)
+    if stream and response and int(info['status']) == 200:
+      return response
     body = '"no body data"'
     if response:
       body = response.read()
@@ -167,16 +615,33 @@ class IDM(AnsibleModule):
       body = info['body']
     if int(info['status']) != 200:
       body = info.get('body')
-      raise Exception('Failed to execute the API request: {0}: {1}'.format(
+      raise IDMError(int(info['status']), 'Failed to execute the API request: {0}: {1}'.format(
         info['msg'], body.decode() if type(body) == bytes else str(body)))
     return json.loads(body)
 
   def exit_process(self):
-    changed = len(self.deleted_list) > 0 or len(self.updated_list) > 0 or len(self.added_list) > 0
-    self.exit_json(changed=changed,
-      added_list=self.added_list, updated_list=self.updated_list, deleted_list=self.deleted_list)
+    if not self.params['interfaces']:
+      task = self.tasks[0]
+      result = task.result()
+      if task.diff_list:
+        result['diff'] = task.diff_list
+      self.exit_json(**result)
+      # never reach here
+    diff_list = []
+    for task in self.tasks:
+      diff_list.extend(task.diff_list)
+    result = dict(changed=any(task.changed() for task in self.tasks),
+      interfaces=[dict(interface=task.params['interface'], **task.result()) for task in self.tasks])
+    if diff_list:
+      result['diff'] = diff_list
+    self.exit_json(**result)
     # never reach here
 
+def _digest(instance):
+  # stable serialization, so that the digest does not depend on the order of properties
+  return hashlib.sha1(json.dumps(instance, sort_keys=True, ensure_ascii=False,
+    separators=(',', ':'), default=str).encode('utf-8')).hexdigest()
+
 def _byteify(data, ignore_dicts = False):
     # if this is a unicode string, return its string representation
     if isinstance(data, str):
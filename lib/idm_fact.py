@@ -12,6 +12,10 @@ from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.urls import fetch_url
 from ansible.module_utils.six.moves.urllib.parse import urlencode
 import json
+try:
+  import ijson
+except ImportError:
+  ijson = None
 
 class IDM_facts(AnsibleModule):
   def __init__(self):
@@ -21,25 +25,106 @@ class IDM_facts(AnsibleModule):
       port=dict(required=False,type='int',default=8090),
       system_account=dict(required=False,default='IDM_AUTO_BUILDER'),
       filter=dict(required=False,type='dict'),
-      properties=dict(required=False,type='list',elements='str')
+      properties=dict(required=False,type='list',elements='str'),
+      page_size=dict(required=False,type='int',default=0),
+      key_property=dict(required=False),
+      count_only=dict(required=False,type='bool',default=False),
+      keys_only=dict(required=False,type='bool',default=False),
+      output_file=dict(required=False,type='path')
     )
-    super(IDM_facts, self).__init__(argument_spec=argument_spec, supports_check_mode=True)
+    super(IDM_facts, self).__init__(argument_spec=argument_spec, supports_check_mode=True,
+      mutually_exclusive=[('count_only', 'keys_only'), ('count_only', 'output_file')],
+      required_if=[('keys_only', True, ['key_property'])])
 
   def process_task(module):
     params = {}
     if module.params['filter']:
       params['_filter'] = module.jsonify(module.params['filter'])
-    if module.params['properties']:
-      params['_properties'] = ','.join(module.params['properties'])
+    properties = module.params['properties']
+    key_property = module.params['key_property']
+    if module.params['keys_only']:
+      properties = [key_property]
+    elif module.params['count_only'] and key_property:
+      # nothing but the number of instances is needed, so let the server send only the keys
+      properties = [key_property]
+    if properties:
+      params['_properties'] = ','.join(properties)
     module.params['validate_certs'] = False
 
-    result = module.call_idm(params, 'GET')
+    if module.params['count_only']:
+      count = 0
+      for instance in module.iter_idm(params):
+        count += 1
+      return dict(count=count)
 
-    for instance in result:
-      instance.pop('_csn', None)
-    return result
+    output = None
+    if module.params['output_file']:
+      output = open(module.params['output_file'], 'w')
+    try:
+      result = []
+      count = 0
+      for instance in module.iter_idm(params):
+        instance.pop('_csn', None)
+        if module.params['keys_only']:
+          if key_property not in instance:
+            raise Exception('Instance {0} from the interface {1} does not have key property {2}'.format(
+              module.jsonify(instance), module.params['interface'], key_property))
+          instance = instance[key_property]
+        count += 1
+        if output:
+          output.write(json.dumps(instance, ensure_ascii=False))
+          output.write('\n')
+        else:
+          result.append(instance)
+    finally:
+      if output:
+        output.close()
+    if output:
+      return dict(output_file=module.params['output_file'], count=count)
+    if module.params['keys_only']:
+      return dict(keys=result, count=count)
+    return dict(result=result)
 
-  def call_idm(module, params, method = 'GET', key = '', data = {}, interface = ''):
+  def iter_idm(module, params):
+    # read the interface page by page with _offset/_limit, so that only one page
+    # of instances is held in memory at a time
+    page_size = module.params['page_size']
+    if page_size <= 0:
+      for instance in module.stream_idm(params):
+        yield instance
+      return
+    offset = 0
+    # an interface ignoring _offset/_limit would make the loop endless
+    page_heads = set()
+    while True:
+      page_params = dict(params)
+      page_params['_offset'] = offset
+      page_params['_limit'] = page_size
+      count = 0
+      for instance in module.stream_idm(page_params):
+        if count == 0:
+          head = json.dumps(instance, sort_keys=True)
+          if head in page_heads:
+            raise Exception('The interface returned the same page again at _offset={0}, _offset may not be supported'.format(offset))
+          page_heads.add(head)
+        count += 1
+        if count > page_size:
+          raise Exception('The interface returned more than {0} instances at _offset={1}, _limit may not be supported'.format(page_size, offset))
+        yield instance
+      if count < page_size:
+        return
+      offset += count
+
+  def stream_idm(module, params):
+    response = module.call_idm(params, stream = True)
+    if ijson is None:
+      for instance in json.loads(response.read()):
+        yield instance
+    else:
+      for instance in ijson.items(response, 'item', use_float=True):
+        yield instance
+
+  def call_idm(module, params, method = 'GET', key = '', data = {}, interface = '', stream = False):
     if not interface:
       interface = module.params['interface']
     url = 'http://' + module.params['host'] + ':' + str(module.params['port']) + '/IDManager/' + interface
@@ -55,13 +140,15 @@ class IDM_facts(AnsibleModule):
       datastr = json.dumps(data, ensure_ascii=False)
       module.debug("call idm with body: " + datastr)
     response, info = fetch_url(module, url, method=method, headers=headers, data=datastr)
+    if stream and response and int(info['status']) == 200:
+      return response
     body = '"no body data"'
     if response:
       body = response.read()
     elif 'body' in info:
       body = info['body']
     if int(info['status']) != 200:
-      raise StandardError('Failed to execute the API request: {0}: {1}'.format(
+      raise Exception('Failed to execute the API request: {0}: {1}'.format(
         info['msg'], json.dumps(body, ensure_ascii=False)))
     return json.loads(body)
 
@@ -96,7 +183,7 @@ def main():
   except Exception as e:
     idm_facts.fail_json(msg=str(e))
     # never reach here
-  idm_facts.exit_json(result=result)
+  idm_facts.exit_json(**result)
   # never reach here
 
 if __name__ == '__main__':
@@ -10,7 +10,71 @@
 # ansible -m idm_fact -M . -c docker -i ,idm -a 'interface=_classes/_classDefinition' idm
 from ansible.module_utils.basic import AnsibleModule
 import json
+import multiprocessing
+import os
 import re
+try:
+  import yaml
+except ImportError:
+  yaml = None
+
+backreference_re = re.compile(r'\\[1-9]|\(\?P=')
+
+class TargetReplacer:
+  def __init__(self, targets):
+    # compile the targets once, each value is first tested against one combined regex
+    # for all the regex targets and one alternation of all the literal values
+    self.targets = []
+    combined = []
+    self.regex_list = []
+    literals = []
+    for target in targets:
+      regex = target.get('regex')
+      value = target.get('value')
+      compiled = re.compile(regex) if regex else None
+      self.targets.append((compiled, value, '{{ ' + target['expression'] + ' }}'))
+      if compiled:
+        # group numbers shift in a combined pattern, so patterns with backreferences are tested alone
+        if backreference_re.search(regex):
+          self.regex_list.append(compiled)
+        else:
+          combined.append(regex)
+      if value:
+        literals.append(value)
+    self.regex_any = None
+    if combined:
+      try:
+        self.regex_any = re.compile('|'.join('(?:{0})'.format(regex) for regex in combined))
+      except re.error:
+        # e.g. global flags in the middle of the combined pattern
+        self.regex_list.extend(re.compile(regex) for regex in combined)
+    self.literal_any = None
+    if literals:
+      self.literal_any = re.compile('|'.join(re.escape(value) for value in sorted(set(literals), key=len, reverse=True)))
+
+  def matches(self, value):
+    if self.regex_any and self.regex_any.match(value):
+      return True
+    if self.literal_any and self.literal_any.search(value):
+      return True
+    return any(compiled.match(value) for compiled in self.regex_list)
+
+  def replace_value(self, value):
+    result = str(value)
+    # a value that no target matches is never changed by the targets in turn
+    if not self.matches(result):
+      return value, False
+    changed = False
+    for compiled, target_value, expression in self.targets:
+      if compiled and compiled.match(result):
+        result = compiled.sub(result, expression)
+        changed = True
+      elif target_value and target_value in result:
+        result = result.replace(target_value, expression)
+        changed = True
+    if not changed:
+      return value, False
+    return result, True
 
 class IDMDownloadFormat(AnsibleModule):
   def __init__(self):
@@ -18,6 +82,9 @@ class IDMDownloadFormat(AnsibleModule):
       mongodb_data=dict(required=True,type='list',elements='dict'),
       mariadb_data=dict(required=True,type='list',elements='dict'),
       targets=dict(required=True,type='list',elements='dict'),
+      output_dir=dict(required=False,type='path'),
+      output_format=dict(required=False,default='yaml',choices=['yaml', 'jsonl']),
+      workers=dict(required=False,type='int',default=1),
     )
     super(IDMDownloadFormat, self).__init__(argument_spec=argument_spec, supports_check_mode=True)
 
@@ -51,54 +118,116 @@ class IDMDownloadFormat(AnsibleModule):
     targets = self.params['targets']
  
     self.changed_list = []
-    stack = []
-
-    self.replace(result, targets, self.changed_list, stack)
-    return result
 
-  def replace(self, instance, targets, changed_list, stack):
-    if type(instance) is dict:
-      result = self.replace_dict(instance, targets, changed_list, stack)
-    elif type(instance) is list:
-      result = self.replace_list(instance, targets, changed_list, stack)
+    output_dir = self.params['output_dir']
+    output_format = self.params['output_format']
+    if output_dir and output_format == 'yaml' and yaml is None:
+      raise Exception('The PyYAML module is required when output_format is yaml.')
+
+    # every phase/interface and every IS table is processed on its own, with output_dir each of them
+    # is written to its own file as soon as it is processed and only the manifest is returned
+    datasets = []
+    for phase, interfaces in phases.items():
+      for if_name in interfaces:
+        datasets.append((interfaces, if_name, ['phases_data', phase, if_name]))
+    for name in is_tables:
+      datasets.append((is_tables, name, ['is_tables_data', name]))
+    tasks = [(stack, container[key], output_dir, output_format) for container, key, stack in datasets]
+
+    workers = min(self.params['workers'], len(tasks))
+    context = None
+    if workers > 1:
+      # forked workers inherit this module, spawned ones could not import it from the AnsiballZ __main__
+      try:
+        context = multiprocessing.get_context('fork')
+      except ValueError:
+        self.debug('fork start method is not available, process the datasets sequentially')
+    if context:
+      # the targets are compiled once in each worker, the results come back in the order of the datasets
+      pool = context.Pool(workers, initializer=_init_worker, initargs=(targets,))
+      try:
+        formatted = pool.map(_format_dataset_in_worker, tasks, chunksize=1)
+      finally:
+        pool.close()
+        pool.join()
     else:
-      result = self.replace_value(instance, targets, changed_list, stack)
-    return result
-
-  def replace_dict(self, instance, targets, changed_list, stack):
-    for key in instance:
-      stack.append(key)
-      value = self.replace(instance[key], targets, changed_list, stack)
-      instance[key] = value
-      stack.pop()
-    return instance
-
-  def replace_list(self, instance, targets, changed_list, stack):
-    def _replace_list(o):
-      stack.append(str(o[0]))
-      r = self.replace(o[1], targets, changed_list, stack)
-      stack.pop()
-      return r
-    result = list(map(_replace_list, enumerate(instance)))
-    return result
-    
-  def replace_value(self, value, targets, changed_list, stack):
-    result = str(value)
-    changed = False
-    for target in targets:
-      regex = target.get('regex')
-      target_value = target.get('value')
-      if regex and re.match(regex, result):
-        result = re.sub(regex, result, '{{ ' + target['expression'] + ' }}')
-        changed = True
-      elif target_value and target_value in result:
-        result = result.replace(target_value, '{{ ' + target['expression'] + ' }}')
-        changed = True
+      replacer = TargetReplacer(targets)
+      formatted = [format_dataset(replacer, *task) for task in tasks]
+
+    manifest = []
+    for (container, key, stack), (data, changed_list, entry) in zip(datasets, formatted):
+      self.changed_list.extend(changed_list)
+      if output_dir:
+        manifest.append(entry)
+      else:
+        container[key] = data
+    if output_dir:
+      return dict(manifest=manifest)
+    return dict(result=result)
+
+def _children(container):
+  if type(container) is dict:
+    return iter(container)
+  return iter(range(len(container)))
+
+def replace_tree(instance, targets, changed_list, stack):
+  # walk the tree with an explicit stack instead of recursion and replace the values
+  # in place, the dotted path is built only for the values that are changed
+  if type(instance) is not dict and type(instance) is not list:
+    result, changed = targets.replace_value(instance)
     if changed:
       changed_list.append(".".join(stack))
-    else:
-      result = value
     return result
+  path = list(stack)
+  pending = [(instance, _children(instance))]
+  while pending:
+    container, keys = pending[-1]
+    for key in keys:
+      value = container[key]
+      if type(value) is dict or type(value) is list:
+        path.append(key if type(container) is dict else str(key))
+        pending.append((value, _children(value)))
+        break
+      result, changed = targets.replace_value(value)
+      if changed:
+        container[key] = result
+        changed_list.append(".".join(path + [key if type(container) is dict else str(key)]))
+    else:
+      pending.pop()
+      if pending:
+        path.pop()
+  return instance
+
+_worker_targets = None
+
+def _init_worker(targets):
+  global _worker_targets
+  _worker_targets = TargetReplacer(targets)
+
+def _format_dataset_in_worker(task):
+  return format_dataset(_worker_targets, *task)
+
+def format_dataset(targets, stack, data, output_dir, output_format):
+  changed_list = []
+  data = replace_tree(data, targets, changed_list, stack)
+  if output_dir:
+    return None, changed_list, write_dataset(output_dir, output_format, stack, data)
+  return data, changed_list, None
+
+def write_dataset(output_dir, output_format, stack, data):
+  extension = '.yml' if output_format == 'yaml' else '.jsonl'
+  path = os.path.join(output_dir, *stack) + extension
+  # several workers may create the directory of a phase at the same time
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, 'w') as f:
+    if output_format == 'yaml':
+      yaml.safe_dump(data, f, allow_unicode=True, default_flow_style=False)
+    else:
+      for record in (data if type(data) is list else [data]):
+        f.write(json.dumps(record, ensure_ascii=False))
+        f.write('\n')
+  return dict(dataset=stack[0], name='/'.join(stack[1:]), path=path,
+    count=len(data) if type(data) is list else 1)
 
 def main():
   module = IDMDownloadFormat()
@@ -109,7 +238,7 @@ def main():
     # never reach here
   changed = len(module.changed_list) > 0
 
-  module.exit_json(result=result, changed=changed, changed_list=module.changed_list)
+  module.exit_json(changed=changed, changed_list=module.changed_list, **result)
   # never reach here
 
 if __name__ == '__main__':
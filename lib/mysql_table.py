@@ -27,6 +27,19 @@ options:
     default: True
     description:
       - delete orphand records when True
+  batch_size:
+    required: False
+    default: 1
+    description:
+      - 'number of records written by one INSERT/UPDATE/DELETE statement. 1: one statement per record'
+  engine:
+    required: False
+    default: python
+    choices:
+    - python
+    - staging
+    description:
+    - 'how to compute the difference(python: read the table and compare each record in the module, staging: load values into a temporary table and compare them by SQL joins on key_columns in the database server. all records of values must have the same columns, only those columns are compared and written)'
   state:
     required: False
     default: update
@@ -108,6 +121,8 @@ from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.database import mysql_quote_identifier
 import json
 import datetime
+import decimal
+import hashlib
 
 # make mysql-query backward compatible with ansible < 2.7.2
 try:
@@ -123,96 +138,94 @@ except ImportError:
 from ansible.module_utils._text import to_native
 
 class MultiKeyMap:
+  # flat index keyed by the tuple of normalized key column values
+  __slots__ = ('key_columns', 'map_dict', 'module', 'verbose')
+
   def __init__(self, key_columns, module):
-    self.key_columns = key_columns
+    self.key_columns = tuple(key_columns)
     self.map_dict= {}
     self.module = module
-    self.module.debug('MultiKeyMap.init called key_columns={0} type={1}'.format(key_columns, type(key_columns)))
-
-  def set(self, value, map_dict= None, key_index = 0):
-    if map_dict is None:
-      map_dict= self.map_dict
-    if key_index >= len(self.key_columns):
-      raise AssertionError('key index {0} is out of range for key columns {1}'.format(key_index, self.key_columns))
-    key = self.key_columns[key_index]
-    self.module.debug('MultiKeyMap.set key = {0}'.format(key))
-    if key not in value:
-      self.module.debug('MultiKeyMap.set Error: {Value {0} does not have key {1}'.format(json.dumps(value, ensure_ascii=False), key))
-      raise IndexError('MultiKeyMap.set: Value {0} does not have key {1}'.format(json.dumps(value, ensure_ascii=False), key))
-
-    self.module.debug('MultiKeyMap.set key: value={0} {1} {2}'.format(value, type(value[key]), value[key] == '\x00'))
-    # self.module.debug('MultiKeyMap.set key: value[{0}] = {1}'.format(key, value[key]))
-    key_value = value[key]
-    if key_value == '\x00' or key_value == b'\x00':
-      key_value = 'bit0'
-    if key_value == '\x01' or key_value == b'\x01':
-      key_value = 'bit1'
-
-    if key_index == len(self.key_columns) - 1:
-      if key_value in map_dict:
-        raise LookupError('MultiKeyMap.set: Value {0} has same key  with {1}'.format(json.dumps(value, ensure_ascii=False), json.dumps(map_dict[key], ensure_ascii=False)))
-      map_dict[key_value] = value
-      self.module.debug('MultiKeyMap.set {0} : {1} for {2}'.format(key_value, value, key))
-    else:
-      if key_value not in map_dict:
-        map_dict[key_value] = dict()
-      self.module.debug('MultiKeyMap.set recursive call for {0} for {1}'.format(key_value, key))
-      self.set(value, map_dict = map_dict[key_value], key_index = key_index + 1)
-
-  def pop(self, value, map_dict = None, key_index = 0):
-    if map_dict is None:
-      map_dict = self.map_dict
-    if key_index >= len(self.key_columns):
-      raise AssertionError('key index {0} is out of range for key columns {1}'.format(key_index, self.key_columns))
-    key = self.key_columns[key_index]
-    if key not in value:
-      raise IndexError('MultiKeyMap.get: Key value {0} does not have key {1}'.format(json.dumps(value, ensure_ascii=False), key))
-    key_value = value[key]
-    if key_value == '\x00' or key_value == b'\x00':
-      key_value = 'bit0'
-    if key_value == '\x01' or key_value == b'\x01':
-      key_value = 'bit1'
-    if key_value not in map_dict:
-      return None
-    elif key_index == len(self.key_columns) - 1:
-      return map_dict.pop(key_value)
-    else:
-      return self.pop(value, map_dict = map_dict[key_value], key_index = key_index + 1)
-
-  # def len(self, map_dict = None, key_index = 0):
-  #   if map_dict is None:
-  #     map_dict = self.map_dict
-  #   if key_index >= len(self.key_columns):
-  #     raise AssertionError('key index {0} is out of range for key columns {1}'.format(key_index, self.key_columns))
-  #   elif key_index == len(self.key_columns) - 1:
-  #     return len(map_dict.keys())
-  #   else:
-  #     return sum(map(lambda key: self.len(map_dict = map_dict[key], key_index = key_index + 1), map_dict.keys()))
-
-  def keys(self, map_dict = None, key_index = 0):
-    if map_dict is None:
-      map_dict = self.map_dict
-    if key_index >= len(self.key_columns):
-      raise AssertionError('key index {0} is out of range for key columns {1}'.format(key_index, self.key_columns))
-    elif key_index == len(self.key_columns) - 1:
-      for key in map_dict.keys():
-        dict_val = {}
-        dict_val[self.key_columns[key_index]] = key
-        yield dict_val
+    # format debug messages only when debug output is enabled
+    self.verbose = module._debug
+    if self.verbose:
+      self.module.debug('MultiKeyMap.init called key_columns={0} type={1}'.format(key_columns, type(key_columns)))
+
+  def key_of(self, value, caller):
+    key = []
+    for column in self.key_columns:
+      if column not in value:
+        raise IndexError('MultiKeyMap.{0}: Value {1} does not have key {2}'.format(
+          caller, json.dumps(value, ensure_ascii=False, default=str), column))
+      key_value = value[column]
+      if key_value == '\x00' or key_value == b'\x00':
+        key_value = 'bit0'
+      elif key_value == '\x01' or key_value == b'\x01':
+        key_value = 'bit1'
+      key.append(key_value)
+    return tuple(key)
+
+  def set(self, value, entry=None):
+    # entry: what to store for the key instead of value itself
+    key = self.key_of(value, 'set')
+    if key in self.map_dict:
+      raise LookupError('MultiKeyMap.set: Value {0} has same key  with {1}'.format(
+        json.dumps(value, ensure_ascii=False, default=str), json.dumps(self.map_dict[key], ensure_ascii=False, default=str)))
+    self.map_dict[key] = value if entry is None else entry
+    if self.verbose:
+      self.module.debug('MultiKeyMap.set {0} : {1}'.format(key, value))
+
+  def pop(self, value):
+    return self.map_dict.pop(self.key_of(value, 'get'), None)
+
+  def keys(self):
+    for key in self.map_dict:
+      yield dict(zip(self.key_columns, key))
+
+  def items(self):
+    for key, value in self.map_dict.items():
+      yield dict(zip(self.key_columns, key)), value
+
+  def __len__(self):
+    return len(self.map_dict)
+
+DATETIME_TYPES = ('datetime', 'timestamp')
+
+def canonical_value(value):
+  # canonical form of a column value, values equal as python objects get the same form
+  if value is None:
+    return value
+  if isinstance(value, (int, float, decimal.Decimal)):
+    number = decimal.Decimal(value)
+    if number.is_zero():
+      number = decimal.Decimal(0)
+    # precision of all digits, normalize of the default context rounds to 28 digits
+    context = decimal.Context(prec=max(len(number.as_tuple().digits), 1))
+    return ['n', str(number.normalize(context))]
+  if isinstance(value, (bytes, bytearray)):
+    return ['b', value.decode('latin-1')]
+  if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+    return ['t', value.isoformat()]
+  if isinstance(value, str):
+    return value
+  return ['r', repr(value)]
+
+def json_safe_record(record):
+  if record is None:
+    return {}
+  safe = {}
+  for column, value in record.items():
+    if value is None or isinstance(value, (bool, int, float, str)):
+      safe[column] = value
+    elif isinstance(value, (bytes, bytearray)):
+      safe[column] = value.decode('latin-1')
     else:
-      for my_key in map_dict.keys():
-        for children_key in self.keys(map_dict = map_dict[my_key], key_index = key_index + 1):
-          children_key[self.key_columns[key_index]] = my_key
-          yield children_key
+      # Decimal, datetime, timedelta, ...
+      safe[column] = str(value)
+  return safe
 
-def str2time(record, module):
-  for key in record.keys():
-    try:
-      record[key] = datetime.datetime.strptime(record[key], "%Y-%m-%dT%H:%M:%S")
-      module.debug('value {0} of datetime field {1} is converted'.format(record[key], key))
-    except:
-      pass
-  return record
+def fingerprint(record):
+  items = sorted([[key, canonical_value(value)] for key, value in record.items()], key=lambda item: item[0])
+  return hashlib.sha1(json.dumps(items, ensure_ascii=False).encode('utf-8')).digest()
 
 class MysqlTable(AnsibleModule):
   def __init__(self):
@@ -228,6 +241,8 @@ class MysqlTable(AnsibleModule):
       columns=dict(default='*',required=False),
       key_columns=dict(type='list',elements='str', required=True),
       delete_orphands=dict(required=False,type='bool',default=True),
+      batch_size=dict(required=False,type='int',default=1),
+      engine=dict(required=False,default='python', choices=['python', 'staging']),
       values=dict(type='list',elements='dict',required=True)
     )
     super(MysqlTable, self).__init__(argument_spec=argument_spec, supports_check_mode=True)
@@ -235,6 +250,9 @@ class MysqlTable(AnsibleModule):
     self.deleted_list = []
     self.updated_list = []
     self.added_list = []
+    self.pending = dict(delete=[], update=[], insert=[])
+    self.column_types = None
+    self.diff_list = []
     self.exc_value = None
 
   def build_connection_parameter(self):
@@ -294,6 +312,25 @@ class MysqlTable(AnsibleModule):
       self.debug('execute query "{0}" count={1}'.format(query, res))
       return cursor.fetchall()
 
+  def query_column_types(self):
+    with self.db_connection.cursor() as cursor:
+      query = "SELECT COLUMN_NAME AS name, DATA_TYPE AS type FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s"
+      res = cursor.execute(query, (self.params['db'], self.params['table']))
+      self.debug('execute query "{0}" count={1}'.format(query, res))
+      self.column_types = dict([(record['name'], record['type'].lower()) for record in cursor.fetchall()])
+
+  def coerce(self, target):
+    # convert only string values of datetime columns, as the database returns them as datetime
+    for column, value in target.items():
+      if isinstance(value, str) and self.column_types.get(column) in DATETIME_TYPES:
+        try:
+          target[column] = datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S")
+        except ValueError:
+          continue
+        if self._debug:
+          self.debug('value {0} of datetime field {1} is converted'.format(target[column], column))
+    return target
+
   def build_where_clause(self):
     where = ' AND '.join(['{0} = %s'.format(mysql_quote_identifier(column, 'column')) for column in self.params['key_columns']])
     if self.params['filter']:
@@ -314,24 +351,117 @@ class MysqlTable(AnsibleModule):
       table_id = mysql_quote_identifier(self.params['table'], 'table')
       set_clause = ', '.join(['{0} = %s'.format(mysql_quote_identifier(column, 'column')) for column in target.keys()])
       query = "UPDATE {0} SET {1} WHERE {2} LIMIT 1".format(table_id, set_clause, self.build_where_clause())
-      key_values = list() #空のリスト作成
-      for param in self.params['key_columns']: #for文、self.params['key_columns']をparamに入れて順にぶん回し
-        value = target[param]
-        if param == 'temp':
-          if value == '\x00' or value == b'\x00':
-            value = '0'
-            key_values.append(value) #\x00なら配列に0を代入
-          else:
-            value = '1'
-            key_values.append(value) #\x00以外なら1を代入
-        else:
-          key_values.append(value)
+      key_values = self.update_key_values(target)
       # TODO
       values = tuple(list(target.values()) + key_values)
       # values = tuple(target.values() + map(lambda col: target[col], self.params['key_columns']))
       res = cursor.execute(query, values)
       self.debug('execute query "{0}" with parameter={1} count={2}'.format(query, values, res))
 
+  def update_key_values(self, target):
+    key_values = list() #空のリスト作成
+    for param in self.params['key_columns']: #for文、self.params['key_columns']をparamに入れて順にぶん回し
+      value = target[param]
+      if param == 'temp':
+        if value == '\x00' or value == b'\x00':
+          value = '0'
+          key_values.append(value) #\x00なら配列に0を代入
+        else:
+          value = '1'
+          key_values.append(value) #\x00以外なら1を代入
+      else:
+        key_values.append(value)
+    return key_values
+
+  def build_key_in_clause(self, count):
+    # (k1, k2) IN ((%s, %s), ...) for the given number of rows
+    key_columns = self.params['key_columns']
+    columns = ', '.join([mysql_quote_identifier(column, 'column') for column in key_columns])
+    placeholder = ', '.join(['%s'] * len(key_columns))
+    if len(key_columns) > 1:
+      columns = '({0})'.format(columns)
+      placeholder = '({0})'.format(placeholder)
+    where = '{0} IN ({1})'.format(columns, ', '.join([placeholder] * count))
+    if self.params['filter']:
+      where += ' AND ({0})'.format(self.params['filter'])
+    return where
+
+  def chunks(self, targets):
+    # group rows by their set of columns and split the groups into batch_size rows
+    groups = {}
+    for target in targets:
+      groups.setdefault(tuple(target.keys()), []).append(target)
+    batch_size = self.params['batch_size']
+    for columns, rows in groups.items():
+      for index in range(0, len(rows), batch_size):
+        yield columns, rows[index:index + batch_size]
+
+  def insert_records(self, targets):
+    table_id = mysql_quote_identifier(self.params['table'], 'table')
+    for columns, rows in self.chunks(targets):
+      cols = ', '.join(map(lambda x: mysql_quote_identifier(x, 'column'), columns))
+      value_placeholder = '({0})'.format(', '.join(['%s'] * len(columns)))
+      query = "INSERT INTO {0} ({1}) VALUES {2}".format(table_id, cols, ', '.join([value_placeholder] * len(rows)))
+      values = tuple(row[column] for row in rows for column in columns)
+      with self.db_connection.cursor() as cursor:
+        res = cursor.execute(query, values)
+      self.debug('execute query "{0}" for {1} rows count={2}'.format(query, len(rows), res))
+
+  def update_records(self, targets):
+    # one UPDATE per chunk, each column is set with CASE WHEN <key of row> THEN <value of row> ...
+    table_id = mysql_quote_identifier(self.params['table'], 'table')
+    key_columns = self.params['key_columns']
+    key_condition = ' AND '.join(['{0} = %s'.format(mysql_quote_identifier(column, 'column')) for column in key_columns])
+    for columns, rows in self.chunks(targets):
+      key_values = [self.update_key_values(row) for row in rows]
+      set_clauses = []
+      values = []
+      for column in columns:
+        if column in key_columns:
+          continue
+        column_id = mysql_quote_identifier(column, 'column')
+        set_clauses.append('{0} = CASE {1} ELSE {0} END'.format(
+          column_id, ' '.join(['WHEN {0} THEN %s'.format(key_condition)] * len(rows))))
+        for row, row_key_values in zip(rows, key_values):
+          values.extend(row_key_values)
+          values.append(row[column])
+      if not set_clauses:
+        continue
+      for row_key_values in key_values:
+        values.extend(row_key_values)
+      query = "UPDATE {0} SET {1} WHERE {2}".format(table_id, ', '.join(set_clauses), self.build_key_in_clause(len(rows)))
+      with self.db_connection.cursor() as cursor:
+        res = cursor.execute(query, tuple(values))
+      self.debug('execute query "{0}" for {1} rows count={2}'.format(query, len(rows), res))
+
+  def delete_records(self, targets):
+    table_id = mysql_quote_identifier(self.params['table'], 'table')
+    batch_size = self.params['batch_size']
+    for index in range(0, len(targets), batch_size):
+      rows = targets[index:index + batch_size]
+      query = "DELETE FROM {0} WHERE {1}".format(table_id, self.build_key_in_clause(len(rows)))
+      values = tuple(row[column] for row in rows for column in self.params['key_columns'])
+      with self.db_connection.cursor() as cursor:
+        res = cursor.execute(query, values)
+      self.debug('execute query "{0}" for {1} rows count={2}'.format(query, len(rows), res))
+
+  def apply(self, operation, target):
+    if self.check_mode:
+      return
+    if self.params['batch_size'] > 1:
+      self.pending[operation].append(target)
+    else:
+      getattr(self, operation + '_record')(target)
+
+  def flush(self):
+    # deletes first, so that the freed keys can be reused by the inserts
+    if self.pending['delete']:
+      self.delete_records(self.pending['delete'])
+    if self.pending['update']:
+      self.update_records(self.pending['update'])
+    if self.pending['insert']:
+      self.insert_records(self.pending['insert'])
+
   def delete_record(self, target):
     with self.db_connection.cursor() as cursor:
       table_id = mysql_quote_identifier(self.params['table'], 'table')
@@ -340,50 +470,176 @@ class MysqlTable(AnsibleModule):
       res = cursor.execute(query, values)
       self.debug('execute query "{0}" with parameter={1} count={2}'.format(query, values, res))
 
+  def add_diff(self, key, before, after):
+    # one entry per record as the diff callback shows mappings, column values are made JSON safe
+    header = json.dumps(key, ensure_ascii=False, default=str)
+    self.diff_list.append(dict(before_header=header, after_header=header,
+      before=json_safe_record(before), after=json_safe_record(after)))
+
   def do_update(self, before_map):
     state = self.params['state']
     for target in self.params['values']:
       if any(map(lambda key: key not in target, self.params['key_columns'])):
         raise IndexError('Raw {0} does not have some of key column {1}'.format(json.dumps(target, ensure_ascii=False), self.params['key_columns']))
-      target = str2time(target,self)
+      target = self.coerce(target)
       key = dict(map(lambda col: (col, target[col]), self.params['key_columns']))
       before_value = before_map.pop(key)
       if before_value is not None:
+        before_digest, before_record = before_value
         if state == 'absent':
-          if not self.check_mode:
-            self.delete_record(key)
+          self.apply('delete', key)
           self.deleted_list.append(key)
-        elif state == 'update' and target != before_value:
-          if not self.check_mode:
-            self.update_record(target)
-          diff_result = diff(target, before_value)
-          self.debug('differrence of target and before value: {0}'.format(list(diff_result)))
+          if self._diff:
+            self.add_diff(key, before_record, None)
+        elif state == 'update' and fingerprint(target) != before_digest:
+          self.apply('update', target)
+          if before_record is not None:
+            self.debug('differrence of target and before value: {0}'.format(list(diff(target, before_record))))
+            if self._diff:
+              self.add_diff(key, before_record, target)
           self.updated_list.append(key)
       elif state != 'absent':
-        if not self.check_mode:
-          
-          self.insert_record(target)
+        self.apply('insert', target)
         self.added_list.append(key)
-    if len(list(before_map.keys())) > 0 and self.params['delete_orphands'] and state != 'absent' :
-      for key in before_map.keys():
+        if self._diff:
+          self.add_diff(key, None, target)
+    if len(before_map) > 0 and self.params['delete_orphands'] and state != 'absent' :
+      for key, before_value in before_map.items():
         self.debug('delete_orphands {0}'.format(key))
-        if not self.check_mode:
-          self.delete_record(key)
+        self.apply('delete', key)
         self.deleted_list.append(key)
+        if self._diff:
+          self.add_diff(key, before_value[1], None)
+    self.flush()
+
+  def staging_columns(self):
+    # key columns first, then the other columns of values. a column left out of a record must not be
+    # staged as NULL, so all records are required to have the same columns
+    key_columns = self.params['key_columns']
+    columns = None
+    for target in self.params['values']:
+      if any(map(lambda key: key not in target, key_columns)):
+        raise IndexError('Raw {0} does not have some of key column {1}'.format(json.dumps(target, ensure_ascii=False, default=str), key_columns))
+      if columns is None:
+        columns = list(key_columns) + [column for column in target.keys() if column not in key_columns]
+      elif len(target) != len(columns) or any(map(lambda column: column not in target, columns)):
+        raise Exception('engine staging requires the same columns in all values, Raw {0} does not have columns {1}'.format(
+          json.dumps(target, ensure_ascii=False, default=str), columns))
+    return columns if columns is not None else list(key_columns)
+
+  def create_staging_table(self, cursor, name, select, columns):
+    cursor.execute('DROP TEMPORARY TABLE IF EXISTS {0}'.format(name))
+    query = 'CREATE TEMPORARY TABLE {0} {1}'.format(name, select)
+    res = cursor.execute(query)
+    self.debug('execute query "{0}" count={1}'.format(query, res))
+    try:
+      cursor.execute('ALTER TABLE {0} ADD INDEX ({1})'.format(name, columns))
+    except Exception as e:
+      # e.g. TEXT/BLOB key columns can not be indexed without prefix length
+      self.debug('fail to add index to {0}, compare without index: {1}'.format(name, e))
+
+  def staging_keys(self, cursor, query):
+    res = cursor.execute(query)
+    self.debug('execute query "{0}" count={1}'.format(query, res))
+    return list(cursor.fetchall())
+
+  def process_staging(self):
+    state = self.params['state']
+    table_id = mysql_quote_identifier(self.params['table'], 'table')
+    key_columns = self.params['key_columns']
+    columns = self.staging_columns()
+    value_columns = [column for column in columns if column not in key_columns]
+    column_ids = ', '.join([mysql_quote_identifier(column, 'column') for column in columns])
+    key_ids = ', '.join([mysql_quote_identifier(column, 'column') for column in key_columns])
+    desired_id = mysql_quote_identifier('_mysql_table_desired', 'table')
+    current_id = mysql_quote_identifier('_mysql_table_current', 'table')
+
+    def join_on(left, right):
+      return ' AND '.join(['{0}.{2} <=> {1}.{2}'.format(left, right, mysql_quote_identifier(column, 'column')) for column in key_columns])
+
+    def select_keys(alias):
+      return ', '.join(['{0}.{1}'.format(alias, mysql_quote_identifier(column, 'column')) for column in key_columns])
+
+    differs = ' OR '.join(['NOT (d.{0} <=> c.{0})'.format(mysql_quote_identifier(column, 'column')) for column in value_columns])
+    with self.db_connection.cursor() as cursor:
+      # desired records: same column types as the target table, without its constraints
+      self.create_staging_table(cursor, desired_id, 'SELECT {0} FROM {1} LIMIT 0'.format(column_ids, table_id), key_ids)
+      query = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(desired_id, column_ids, ', '.join(['%s'] * len(columns)))
+      rows = []
+      for target in self.params['values']:
+        target = self.coerce(target)
+        rows.append(tuple(target[column] for column in columns))
+      if rows:
+        res = cursor.executemany(query, rows)
+        self.debug('execute query "{0}" for {1} rows count={2}'.format(query, len(rows), res))
+      # current records: snapshot of the filtered range of the target table
+      select = 'SELECT {0} FROM {1}'.format(column_ids, table_id)
+      if self.params['filter']:
+        select += ' WHERE ' + self.params['filter']
+      self.create_staging_table(cursor, current_id, select, key_ids)
+
+      desired_only = 'NOT EXISTS (SELECT 1 FROM {0} c WHERE {1})'.format(current_id, join_on('c', 'd'))
+      current_only = 'NOT EXISTS (SELECT 1 FROM {0} d WHERE {1})'.format(desired_id, join_on('d', 'c'))
+      if state == 'absent':
+        self.deleted_list = self.staging_keys(cursor, 'SELECT {0} FROM {1} c JOIN {2} d ON {3}'.format(
+          select_keys('c'), current_id, desired_id, join_on('c', 'd')))
+      else:
+        self.added_list = self.staging_keys(cursor, 'SELECT {0} FROM {1} d WHERE {2}'.format(
+          select_keys('d'), desired_id, desired_only))
+        if state == 'update' and differs:
+          self.updated_list = self.staging_keys(cursor, 'SELECT {0} FROM {1} d JOIN {2} c ON {3} WHERE {4}'.format(
+            select_keys('d'), desired_id, current_id, join_on('d', 'c'), differs))
+        if self.params['delete_orphands']:
+          self.deleted_list = self.staging_keys(cursor, 'SELECT {0} FROM {1} c WHERE {2}'.format(
+            select_keys('c'), current_id, current_only))
+
+      queries = []
+      if self.deleted_list:
+        query = 'DELETE t FROM {0} t JOIN {1} c ON {2}'.format(table_id, current_id, join_on('t', 'c'))
+        if state == 'absent':
+          query += ' JOIN {0} d ON {1}'.format(desired_id, join_on('d', 'c'))
+        else:
+          query += ' WHERE ' + current_only
+        queries.append(query)
+      if self.updated_list:
+        queries.append('UPDATE {0} t JOIN {1} c ON {2} JOIN {3} d ON {4} SET {5} WHERE {6}'.format(
+          table_id, current_id, join_on('t', 'c'), desired_id, join_on('d', 'c'),
+          ', '.join(['t.{0} = d.{0}'.format(mysql_quote_identifier(column, 'column')) for column in value_columns]),
+          differs))
+      if self.added_list:
+        queries.append('INSERT INTO {0} ({1}) SELECT {2} FROM {3} d WHERE {4}'.format(
+          table_id, column_ids, ', '.join(['d.{0}'.format(mysql_quote_identifier(column, 'column')) for column in columns]),
+          desired_id, desired_only))
+      if not self.check_mode:
+        for query in queries:
+          res = cursor.execute(query)
+          self.debug('execute query "{0}" count={1}'.format(query, res))
+      for table in (desired_id, current_id):
+        cursor.execute('DROP TEMPORARY TABLE IF EXISTS {0}'.format(table))
 
   def exit_process(self):
     changed = len(self.deleted_list) > 0 or len(self.updated_list) > 0 or len(self.added_list) > 0
-    self.exit_json(changed=changed, deleted_list=self.deleted_list, updated_list=self.updated_list, added_list=self.added_list)
+    result = dict(changed=changed, deleted_list=self.deleted_list, updated_list=self.updated_list, added_list=self.added_list)
+    if self.diff_list:
+      result['diff'] = self.diff_list
+    self.exit_json(**result)
     # never reach here
 
   def process_task(self):
+    self.query_column_types()
+    if self.params['engine'] == 'staging':
+      self.process_staging()
+      return
     before_records = self.query_records()
     before_map = MultiKeyMap(self.params['key_columns'], self)
+    # keep whole records only when the differences are reported
+    keep_record = self._diff or self._debug
     for target in before_records:
       try:
-        before_map.set(target)
+        before_map.set(target, (fingerprint(target), target if keep_record else None))
       except Exception as e:
         raise Exception('fail to build before value map from table {0}:{1}'.format(self.params['table'], e))
+    before_records = None
 
     self.do_update(before_map)
 
@@ -392,7 +648,7 @@ def main():
   if mysql_driver is None:
     mysql_table.fail_json(msg=mysql_driver_fail_msg)
     # never reach here
-  if diff is None:
+  if diff is None and (mysql_table._diff or mysql_table._debug):
     mysql_table.fail_json(msg=diff_fail_msg)
     # never reach here
   try:
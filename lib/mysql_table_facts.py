@@ -19,9 +19,31 @@ options:
     description:
       - database name
   table:
-    required: True
+    required: False
+    description:
+      - table name to read. either table or tables is required
+  tables:
+    required: False
+    type: list
+    elements: dict
+    description:
+      - 'list of tables to read in one task. each item has name(table name) and filter, columns, html_fields, html_parser, fetch_size, key_column, start_after, limit, output_file for the table.
+        html_parser, fetch_size and limit not specified are taken from the module parameters.
+        the result is returned as tables keyed by the table name'
+  workers:
+    required: False
+    type: int
+    default: 4
+    description:
+      - 'number of tables read concurrently with tables, each worker uses its own connection'
+  snapshot:
+    required: False
+    type: bool
+    default: False
     description:
-      - table name where to insert/update/delete records
+      - 'read all tables from one consistent snapshot(START TRANSACTION WITH CONSISTENT SNAPSHOT) of InnoDB tables.
+        with more than one worker, the snapshots of the worker connections are started under FLUSH TABLES WITH READ LOCK,
+        that requires RELOAD privilege and blocks writers while the connections are opened'
   login_host:
     required: False
     description:
@@ -52,6 +74,39 @@ options:
     required: False
     type: list
     description: 'list of name of field that value is a html'
+  html_parser:
+    required: False
+    default: html.parser
+    choices:
+    - html.parser
+    - lxml
+    description:
+      - 'parser of html_fields. lxml: faster parser by libxml2, the lxml module is required. lxml repairs invalid nesting of tags by HTML rules, so the result may differ for such html'
+  fetch_size:
+    required: False
+    type: int
+    default: 0
+    description:
+      - 'number of records fetched at once. 0: fetch all records at once, otherwise stream the records with server side cursor(or pages of key_column when specified)'
+  key_column:
+    required: False
+    description:
+      - 'column for keyset pagination, records are read in order of this column. the column must be included in columns
+        and must have a unique index(PRIMARY KEY or UNIQUE) of the column alone, otherwise records sharing a value across pages would be skipped'
+  start_after:
+    required: False
+    description:
+      - 'read the records which value of key_column is greater than this value. use last_key of previous result'
+  limit:
+    required: False
+    type: int
+    description:
+      - 'max number of records to read. when reached, last_key of the result is the value of key_column of the last record'
+  output_file:
+    required: False
+    type: path
+    description:
+      - 'write the records to this file in JSON Lines format instead of returning them as records'
 """
 
 EXAMPLES = """
@@ -91,6 +146,7 @@ EXAMPLES = """
 """
 
 from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
 
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.database import mysql_quote_identifier
@@ -112,85 +168,404 @@ try:
 except ImportError:
   HTMLParser = None
 
+try:
+  from lxml import etree
+except ImportError:
+  etree = None
+
 from ansible.module_utils._text import to_native
 
 import json
 import re
+import threading
 
 all_space_re = re.compile('^\s*$')
 no_tag_children_tags = ['hr', 'br', 'img']
 
-class DictHTMLParser(HTMLParser):
+class DictTreeBuilder:
+    # builds dict tree of html, shared by the parser backends
     def __init__(self, module):
-        HTMLParser.__init__(self)
-        self.stack = []
         self.module = module
+        self.verbose = module._debug
+        self.reset()
+
+    def reset(self):
+        self.stack = []
+        self.root = None
 
     def get_root(self):
         return self.root
 
-    def handle_starttag(self, tag, attrs):
-        if self.stack and self.stack[len(self.stack) - 1]['tag'] in no_tag_children_tags:
-            self.handle_endtag(self.stack[len(self.stack) - 1]['tag'])
-        self.module.debug('start tag tag={0} level={1}'.format(tag, len(self.stack)))
+    def start_tag(self, tag, attrs):
+        stack = self.stack
+        if stack and stack[-1]['tag'] in no_tag_children_tags:
+            self.end_tag(stack[-1]['tag'])
+        if self.verbose:
+            self.module.debug('start tag tag={0} level={1}'.format(tag, len(stack)))
         data = dict(tag=tag)
         if attrs:
             data['tag_attrs'] = dict(attrs)
-        self.stack.append(data)
+        stack.append(data)
 
-    def handle_endtag(self, tag):
-        if self.stack[len(self.stack) - 1]['tag'] != tag:
-          self.handle_endtag(self.stack[len(self.stack) - 1]['tag'])
-        data = self.stack.pop()
+    def end_tag(self, tag):
+        stack = self.stack
+        if not stack:
+            if self.verbose:
+                self.module.debug('ignore end tag after root tag={0}'.format(tag))
+            return
+        # a tag which is not closed explicitly is closed first, then the parent is closed
+        # whatever its tag is, as the recursive DictHTMLParser.handle_endtag did
+        if stack[-1]['tag'] != tag:
+            self.close_tag()
+            if not stack:
+                return
+        self.close_tag()
+
+    def close_tag(self):
+        stack = self.stack
+        data = stack.pop()
         if 'tag_children' in data and len(data['tag_children']) == 1:
-          data['tag_children'] = data['tag_children'][0]
-        if len(self.stack) > 0:
-            target = self.stack[len(self.stack) - 1]
+            data['tag_children'] = data['tag_children'][0]
+        if stack:
+            target = stack[-1]
             if 'tag_children' not in target:
                 target['tag_children'] = []
             target['tag_children'].append(data)
         else:
             self.root = data
-        self.module.debug('end tag tag={0} level={1}'.format(tag, len(self.stack)))
+        if self.verbose:
+            self.module.debug('end tag tag={0} level={1}'.format(data['tag'], len(stack)))
 
-    def handle_data(self, data):
-        if all_space_re.match(data):
+    def add_data(self, data):
+        if not self.stack or all_space_re.match(data):
             return
-        target = self.stack[len(self.stack) - 1]
+        target = self.stack[-1]
         if 'tag_children' not in target:
             target['tag_children'] = []
         target['tag_children'].append(data)
 
 
-def replace_html_field(data, module):
-  module.log("data=" + str(data))
-  for html_field in module.params['html_fields']:
+class DictHTMLParser(HTMLParser):
+    def __init__(self, module):
+        HTMLParser.__init__(self)
+        self.builder = DictTreeBuilder(module)
+
+    def parse(self, html):
+        self.reset()
+        self.builder.reset()
+        self.feed(html)
+        self.close()
+        return self.builder.get_root()
+
+    def handle_starttag(self, tag, attrs):
+        self.builder.start_tag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self.builder.end_tag(tag)
+
+    def handle_data(self, data):
+        self.builder.add_data(data)
+
+
+class LxmlTarget(DictTreeBuilder):
+    # parser target of lxml, html and body elements added by libxml2 around <root> are skipped.
+    # end of hr/br/img is left to the next tag as DictHTMLParser does.
+    def reset(self):
+        DictTreeBuilder.reset(self)
+        self.text = []
+
+    def flush(self):
+        # libxml2 splits text at entities, join them as one text like HTMLParser
+        if self.text:
+            self.add_data(''.join(self.text))
+            self.text = []
+
+    def start(self, tag, attrs):
+        self.flush()
+        if self.stack or tag == 'root':
+            self.start_tag(tag, attrs)
+
+    def end(self, tag):
+        self.flush()
+        if self.stack and tag not in no_tag_children_tags:
+            self.end_tag(tag)
+
+    def data(self, data):
+        self.text.append(data)
+
+    def close(self):
+        return self.root
+
+
+class DictLxmlParser:
+    def __init__(self, module):
+        self.target = LxmlTarget(module)
+
+    def parse(self, html):
+        self.target.reset()
+        parser = etree.HTMLParser(target=self.target)
+        return etree.fromstring(html, parser)
+
+
+class HTMLConverter:
+    # converts html to dict tree with one parser, results are memoized by html string
+    max_cache_size = 10000
+
+    def __init__(self, module, backend):
+        if backend == 'lxml':
+            self.parser = DictLxmlParser(module)
+        else:
+            self.parser = DictHTMLParser(module)
+        self.cache = {}
+
+    def convert(self, html):
+        if html in self.cache:
+            return self.cache[html]
+        result = self.parser.parse('<root>{0}</root>'.format(html)).get('tag_children')
+        if len(self.cache) >= self.max_cache_size:
+            self.cache.clear()
+        self.cache[html] = result
+        return result
+
+
+def replace_html_field(data, reader):
+  if reader.module._debug:
+    reader.module.log("data=" + str(data))
+  for html_field in reader.params['html_fields']:
     if html_field in data:
       if data[html_field]:
-        parser = DictHTMLParser(module)
-        parser.feed('<root>{0}</root>'.format(data[html_field]))
-        data[html_field] = parser.get_root()['tag_children']
+        data[html_field] = reader.html_converter.convert(data[html_field])
       else:
         data.pop(html_field)
   return data
 
+class MysqlTableReader:
+  def __init__(self, module, spec):
+    self.module = module
+    self.params = spec
+    self.db_connection = None
+    self.html_converter = None
+    self.records = []
+    self.count = 0
+    self.last_key = None
+
+  def check_unique_key(self):
+    # keyset pagination by "key > last key" skips records only when the key is unique
+    query = ("select INDEX_NAME as name from information_schema.STATISTICS"
+      " where TABLE_SCHEMA = database() and TABLE_NAME = %s and NON_UNIQUE = 0"
+      " group by INDEX_NAME having count(*) = 1 and max(COLUMN_NAME) = %s")
+    parameters = (self.params['table'], self.params['key_column'])
+    with closing(self.db_connection.cursor()) as cursor:
+      res = cursor.execute(query, parameters)
+      self.module.debug('execute query "{0}" parameters={1} count={2}'.format(query, parameters, res))
+      if not cursor.fetchall():
+        raise Exception('key_column {0} of table {1} must have a unique index of the column alone'.format(
+          self.params['key_column'], self.params['table']))
+
+  def build_query(self, after_key, limit):
+    table_id = mysql_quote_identifier(self.params['table'], 'table')
+    query = "select {columns} from {table}".format(table=table_id, columns=self.params['columns'])
+    conditions = []
+    parameters = []
+    if self.params['filter']:
+      conditions.append('({0})'.format(self.params['filter']))
+    key_column = self.params['key_column']
+    if key_column:
+      key_id = mysql_quote_identifier(key_column, 'column')
+      if after_key is not None:
+        conditions.append('{0} > %s'.format(key_id))
+        parameters.append(after_key)
+      if conditions:
+        query += ' where ' + ' and '.join(conditions)
+      query += ' order by {0}'.format(key_id)
+    elif conditions:
+      query += ' where ' + conditions[0]
+    if limit:
+      query += ' limit {0:d}'.format(limit)
+    return query, tuple(parameters) if parameters else None
+
+  def fetch_records(self, query, parameters):
+    fetch_size = self.params['fetch_size']
+    if fetch_size > 0:
+      # server side cursor, records are not buffered in the client
+      cursor = self.db_connection.cursor(mysql_driver.cursors.SSDictCursor)
+    else:
+      cursor = self.db_connection.cursor()
+    with closing(cursor):
+      res = cursor.execute(query, parameters)
+      self.module.debug('execute query "{0}" parameters={1} count={2}'.format(query, parameters, res))
+      if fetch_size > 0:
+        while True:
+          records = cursor.fetchmany(fetch_size)
+          if not records:
+            break
+          for record in records:
+            yield record
+      else:
+        for record in cursor.fetchall():
+          yield record
+
+  def query_records(self):
+    limit = self.params['limit']
+    key_column = self.params['key_column']
+    fetch_size = self.params['fetch_size']
+    after_key = self.params['start_after']
+    count = 0
+    if limit is not None and limit <= 0:
+      return
+    if not key_column or fetch_size <= 0:
+      query, parameters = self.build_query(after_key, limit)
+      for record in self.fetch_records(query, parameters):
+        count += 1
+        if key_column and count == limit:
+          self.last_key = record[key_column]
+        yield record
+      return
+    # keyset pagination, one query per page of fetch_size records
+    while True:
+      page_size = fetch_size if limit is None else min(fetch_size, limit - count)
+      query, parameters = self.build_query(after_key, page_size)
+      page_count = 0
+      for record in self.fetch_records(query, parameters):
+        page_count += 1
+        after_key = record[key_column]
+        yield record
+      count += page_count
+      if page_count < page_size:
+        break
+      if limit is not None and count >= limit:
+        self.last_key = after_key
+        break
+
+  def process(self, db_connection):
+    self.db_connection = db_connection
+    if self.params['html_fields']:
+      self.html_converter = HTMLConverter(self.module, self.params['html_parser'])
+
+    if self.params['key_column']:
+      self.check_unique_key()
+    records = self.query_records()
+    if self.params['html_fields']:
+      records = (replace_html_field(record, self) for record in records)
+    if self.params['output_file']:
+      with open(self.params['output_file'], 'w') as f:
+        for record in records:
+          f.write(json.dumps(record, ensure_ascii=False, default=str))
+          f.write('\n')
+          self.count += 1
+    else:
+      self.records = list(records)
+      self.count = len(self.records)
+
+  def result(self):
+    result = dict(count=self.count)
+    if self.params['key_column']:
+      result['last_key'] = self.last_key
+    if self.params['output_file']:
+      result['output_file'] = self.params['output_file']
+    else:
+      result['records'] = self.records
+    return result
+
+def start_snapshot(db_connection):
+  with closing(db_connection.cursor()) as cursor:
+    cursor.execute('SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+    cursor.execute('START TRANSACTION WITH CONSISTENT SNAPSHOT')
+
+class MysqlConnectionPool:
+  def __init__(self, module, db_connection):
+    self.module = module
+    self.local = threading.local()
+    self.lock = threading.Lock()
+    self.connections = []
+    self.snapshot = False
+    # the connection opened in __enter__ is lent to the first worker
+    self.spare = [db_connection] if db_connection else []
+
+  def open_snapshot(self, count):
+    # start the snapshots of all connections at the same point while the global read lock is held,
+    # writers are blocked only until the connections are opened
+    main_connection = self.spare[0]
+    with closing(main_connection.cursor()) as cursor:
+      cursor.execute('FLUSH TABLES WITH READ LOCK')
+      try:
+        for _ in range(count - 1):
+          db_connection = mysql_driver.connect(**self.module.connection_parameter)
+          self.connections.append(db_connection)
+          self.spare.append(db_connection)
+          start_snapshot(db_connection)
+        start_snapshot(main_connection)
+      finally:
+        cursor.execute('UNLOCK TABLES')
+    self.snapshot = True
+    self.module.debug('Opened {0} snapshot connections'.format(count))
+
+  def connection(self):
+    # each worker thread keeps its own connection
+    db_connection = getattr(self.local, 'connection', None)
+    if db_connection is None:
+      with self.lock:
+        db_connection = self.spare.pop() if self.spare else None
+      if db_connection is None and self.snapshot:
+        raise AssertionError('no snapshot connection is left for the worker')
+      if db_connection is None:
+        db_connection = mysql_driver.connect(**self.module.connection_parameter)
+        with self.lock:
+          self.connections.append(db_connection)
+        self.module.debug('Connected to db for worker:{0}'.format(self.module.connection_parameter))
+      self.local.connection = db_connection
+    return db_connection
+
+  def close(self):
+    with self.lock:
+      for db_connection in self.connections:
+        try:
+          db_connection.close()
+        except Exception as e:
+          self.module.debug('error occured at close, but ignore it: {0}'.format(e))
+      self.connections = []
+
 class MysqlTable(AnsibleModule):
   def __init__(self):
     argument_spec = dict(
       filter=dict(required=False),
-      table=dict(required=True),
+      table=dict(required=False),
+      tables=dict(required=False, type='list', elements='dict', options=dict(
+        name=dict(required=True),
+        filter=dict(required=False),
+        columns=dict(required=False, default='*'),
+        html_fields=dict(required=False, type='list'),
+        html_parser=dict(required=False, choices=['html.parser', 'lxml']),
+        fetch_size=dict(required=False, type='int'),
+        key_column=dict(required=False),
+        start_after=dict(required=False, type='raw'),
+        limit=dict(required=False, type='int'),
+        output_file=dict(required=False, type='path')
+      )),
+      workers=dict(required=False, type='int', default=4),
+      snapshot=dict(required=False, type='bool', default=False),
       login_password=dict(required=False, no_log=True),
       login_unix_socket=dict(required=False),
       login_user=dict(default='root',required=False),
       login_host=dict(required=False),
       db=dict(required=True),
       columns=dict(default='*',required=False),
-      html_fields=dict(required=False, type='list')
+      html_fields=dict(required=False, type='list'),
+      html_parser=dict(required=False, default='html.parser', choices=['html.parser', 'lxml']),
+      fetch_size=dict(required=False, type='int', default=0),
+      key_column=dict(required=False),
+      start_after=dict(required=False, type='raw'),
+      limit=dict(required=False, type='int'),
+      output_file=dict(required=False, type='path')
     )
-    super(MysqlTable, self).__init__(argument_spec=argument_spec, supports_check_mode=True)
+    super(MysqlTable, self).__init__(argument_spec=argument_spec, supports_check_mode=True,
+      required_one_of=[('table', 'tables')],
+      mutually_exclusive=[('table', 'tables')],
+      required_by=dict(start_after='key_column'))
     self.db_connection = None
     self.exc_value = None
-    self.records = []
+    self.connection_pool = None
+    self.readers = {}
 
   def build_connection_parameter(self):
     """
@@ -222,7 +597,7 @@ class MysqlTable(AnsibleModule):
     try:
       self.db_connection = mysql_driver.connect(**self.connection_parameter)
     except Exception as e:
-      raise StandardError("Error connecting to mysql database: parameter = {0}, error = {1}".format(self.connection_parameter, e))
+      raise Exception("Error connecting to mysql database: parameter = {0}, error = {1}".format(self.connection_parameter, e))
     self.debug('Connected to db:{0}'.format(self.connection_parameter))
 
 
@@ -236,29 +611,59 @@ class MysqlTable(AnsibleModule):
       self.db_connection = None
       self.debug('Closed to db:{0}'.format(self.connection_parameter))
 
-  def query_records(self):
-    with self.db_connection.cursor() as cursor:
-      table_id = mysql_quote_identifier(self.params['table'], 'table')
-      query = "select {columns} from {table}".format(table=table_id, columns=self.params['columns'])
-      if self.params['filter']:
-        query += ' where ' + self.params['filter']
-      res = cursor.execute(query)
-      self.debug('execute query "{0}" count={1}'.format(query, res))
-      self.records = cursor.fetchall()
-
   def process_task(self):
     if self.params['html_fields'] and HTMLParser is None:
         self.fail_json(msg='The HTMLParser module is required when use html_fields.')
+    names = ('table', 'filter', 'columns', 'html_fields', 'html_parser', 'fetch_size', 'key_column', 'start_after',
+      'limit', 'output_file')
+    if self.params['tables']:
+      for item in self.params['tables']:
+        if item['name'] in self.readers:
+          raise Exception('table {0} is specified more than once in tables'.format(item['name']))
+        # fetch_size, limit and html_parser not given for the table are taken from the module parameters
+        spec = dict((name, item.get(name)) for name in names)
+        spec['table'] = item['name']
+        for name in ('fetch_size', 'limit', 'html_parser'):
+          if spec[name] is None:
+            spec[name] = self.params[name]
+        self.readers[item['name']] = MysqlTableReader(self, spec)
+    else:
+      self.readers[self.params['table']] = MysqlTableReader(self, dict((name, self.params[name]) for name in names))
+    for reader in self.readers.values():
+      if reader.params['html_fields'] and reader.params['html_parser'] == 'lxml' and etree is None:
+        self.fail_json(msg='The lxml module is required when html_parser is lxml.')
 
-    self.query_records()
-    if self.params['html_fields']:
-      self.records = map(lambda record: replace_html_field(record, self), self.records)
+    workers = min(self.params['workers'], len(self.readers))
+    if workers <= 1:
+      if self.params['snapshot']:
+        start_snapshot(self.db_connection)
+      for reader in self.readers.values():
+        reader.process(self.db_connection)
+      return
+    # read the tables side by side, each worker thread reads over its own connection
+    self.connection_pool = MysqlConnectionPool(self, self.db_connection)
+    if self.params['snapshot']:
+      self.connection_pool.open_snapshot(workers)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = [executor.submit(lambda reader: reader.process(self.connection_pool.connection()), reader)
+      for reader in self.readers.values()]
+    try:
+      for future in futures:
+        future.result()
+    finally:
+      for future in futures:
+        future.cancel()
+      executor.shutdown(wait=True)
+      self.connection_pool.close()
+      self.connection_pool = None
 
   def exit_process(self):
     if self.exc_value:
       self.fail_json(msg=str(self.exc_value))
+    elif self.params['tables']:
+      self.exit_json(tables=dict((name, reader.result()) for name, reader in self.readers.items()))
     else:
-      self.exit_json(records=self.records)
+      self.exit_json(**self.readers[self.params['table']].result())
     # never reach here
 
 def main():
@@ -24,7 +24,33 @@ options:
     description:
     - Record name
     - If name is not an FQDN, zone will be added at the end to create an FQDN
-    required: true
+    - Either name or rrsets is required
+    required: false
+  rrsets:
+    description:
+    - >
+      List of rrsets to ensure in the zone at once. Each item has name, type,
+      content (list of the whole content of the rrset), ttl, disabled and
+      state (present or absent). ttl, disabled and state not given are taken
+      from the module parameters. The zone is read once and all changes are
+      sent in one PATCH request.
+    required: false
+  purge:
+    description:
+    - With rrsets, delete the rrsets of the zone which are not listed, except SOA and NS of the zone apex.
+    required: false
+    default: false
+  batch_ptr:
+    description:
+    - >
+      With rrsets and set_ptr, compute the PTR records of the A/AAAA rrsets
+      to write in the module instead of letting the server set them one by
+      one. PTR rrsets are grouped by the most specific reverse zone and each
+      reverse zone is written by one PATCH, concurrently with the forward
+      zone. If no matching reverse zone, an error is thrown. The PTR rrsets
+      are returned as ptr_rrsets keyed by reverse zone.
+    required: false
+    default: false
   server:
     description:
     - Server name.
@@ -78,10 +104,67 @@ options:
     description:
     - Disables strict certificate checking
     default: true
+  pdns_pool_size:
+    description:
+    - Number of keep-alive connections kept to PowerDNS API
+    required: false
+    default: 10
+  pdns_connect_timeout:
+    description:
+    - Timeout in seconds to connect to PowerDNS API
+    required: false
+    default: 5
+  pdns_read_timeout:
+    description:
+    - Timeout in seconds to wait for a response of PowerDNS API
+    required: false
+    default: 30
+  pdns_retries:
+    description:
+    - >
+      Number of retries of a request on connection errors and 5xx responses.
+      POST is not retried.
+    required: false
+    default: 3
+  pdns_backoff_factor:
+    description:
+    - Backoff factor of the retries, the retries wait backoff_factor * 2 ** (retry count - 1) seconds
+    required: false
+    default: 0.5
+  rrset_filter:
+    description:
+    - >
+      Look up the record with rrset_name and rrset_type filters of the zone
+      API (PowerDNS 4.8 or later) instead of reading all rrsets of the zone.
+    required: false
+    default: false
+  verify:
+    description:
+    - >
+      Read the record again after it is written and return it. By default the
+      record is built from the written content, and read again only when the
+      server returns a body to the PATCH request.
+    required: false
+    default: false
 author: "Thomas Krahn (@nosmoht)"
 '''
 
 EXAMPLES = '''
+- powerdns_record:
+    zone: internal.example.com
+    rrsets:
+    - name: host01
+      type: A
+      content:
+      - 192.168.1.234
+    - name: www
+      type: CNAME
+      content:
+      - host01.internal.example.com.
+    - name: old
+      type: A
+      state: absent
+    pdns_api_key: topsecret
 - powerdns_record:
     name: host01.internal.example.com
     type: A
@@ -94,12 +177,21 @@ EXAMPLES = '''
     pdns_api_key: topsecret
 '''
 
+import ipaddress
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     HAS_REQUESTS = True
 except ImportError:
     HAS_REQUESTS = False
 
+# methods retried on connection errors and 5xx responses, PATCH of rrsets with REPLACE/DELETE is idempotent
+RETRY_METHODS = frozenset(['HEAD', 'GET', 'PUT', 'DELETE', 'OPTIONS', 'PATCH'])
+
 
 class PowerDNSError(Exception):
     def __init__(self, url, status_code, message):
@@ -109,12 +201,44 @@ class PowerDNSError(Exception):
         super(PowerDNSError, self).__init__()
 
 
+def build_retry(retries, backoff_factor):
+    kwargs = dict(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff_factor,
+                  status_forcelist=[500, 502, 503, 504], raise_on_status=False)
+    try:
+        return Retry(allowed_methods=RETRY_METHODS, **kwargs)
+    except TypeError:
+        # urllib3 older than 1.26
+        return Retry(method_whitelist=RETRY_METHODS, **kwargs)
+
+
 class PowerDNSClient:
-    def __init__(self, host, port, prot, api_key, verify):
+    def __init__(self, host, port, prot, api_key, verify, rrset_filter=False, pool_size=10, connect_timeout=5,
+                 read_timeout=30, retries=3, backoff_factor=0.5):
         self.url = '{prot}://{host}:{port}/api/v1'.format(prot=prot, host=host, port=port)
         self.session = requests.Session()
         self.session.headers.update({'X-API-Key': api_key})
         self.session.verify = verify
+        # keep-alive connections are reused by all requests of the task
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=build_retry(retries, backoff_factor))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.latencies = list()
+        self.rrset_filter = rrset_filter
+        # rrsets of the zones read in this process: (server, zone) -> {(name, type): rrset}
+        self.rrset_index = dict()
+
+    def _request(self, method, url, **kwargs):
+        start = time.time()
+        req = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        self.latencies.append(dict(method=method, url=url, status=req.status_code,
+                                   seconds=round(time.time() - start, 6)))
+        return req
+
+    def metrics(self):
+        return dict(requests=self.latencies, count=len(self.latencies),
+                    seconds=round(sum(latency['seconds'] for latency in self.latencies), 6))
 
     def _handle_request(self, req):
         if req.status_code in [200, 201, 204]:
@@ -147,9 +271,6 @@ class PowerDNSClient:
           pass
         return data.text
 
-    def _get_search_url(self, server):
-        return '{url}/servers/{server}/search-data'.format(url=self.url,
-                                                           server=server)
     def _get_zones_url(self, server):
         return '{url}/servers/{server}/zones'.format(url=self.url, server=server)
 
@@ -163,39 +284,77 @@ class PowerDNSClient:
 
         return name
 
+    def get_zones(self, server):
+        return self._handle_request(self._request('GET', self._get_zones_url(server)))
+
     def get_zone(self, server, name):
-        req = self.session.get(url=self._get_zone_url(server, name))
-        if req.status_code == 422:  # zone does not exist
+        req = self._request('GET', self._get_zone_url(server, name))
+        if req.status_code == 422 or req.status_code == 404:  # zone does not exist
             return None
         return self._handle_request(req)
 
-    def get_record(self, server, zone, name, rtype):
-        """Search for a given record (name) in the specified zone."""
-        url = self._get_search_url(server)
-        params = {'q': name}
-
-        resp = self._handle_request(self.session.get(url=url, params=params))
+    def get_rrset_index(self, server, zone):
+        """Return the rrsets of the zone keyed by (name, type), None if the zone does not exist."""
+        key = (server, self._make_canonical(zone))
+        if key not in self.rrset_index:
+            zone_data = self.get_zone(server, zone)
+            if zone_data is None:
+                return None
+            self.rrset_index[key] = dict(((rrset['name'], rrset['type']), rrset) for rrset in zone_data.get('rrsets', []))
+        return self.rrset_index[key]
+
+    def _get_filtered_rrset(self, server, zone, name, rtype):
+        # rrset_name/rrset_type filters of PowerDNS 4.8 or later, only the rrset is returned
+        req = self._request('GET', self._get_zone_url(server, zone), params=dict(rrset_name=name, rrset_type=rtype))
+        if req.status_code == 422 or req.status_code == 404:  # zone does not exist
+            return None
+        for rrset in self._handle_request(req).get('rrsets', []):
+            if rrset['name'] == name and rrset['type'] == rtype:
+                return rrset
+        return None
+
+    def _forget_zone(self, server, zone):
+        # the rrsets of the zone are read again at the next lookup
+        self.rrset_index.pop((server, self._make_canonical(zone)), None)
+
+    def _apply_to_index(self, server, zone, rrsets):
+        # reflect the changes written to the zone without reading it again
+        index = self.rrset_index.get((server, self._make_canonical(zone)))
+        for rrset in rrsets:
+            if any(record.get('set-ptr') for record in rrset['records']):
+                # the server changed PTR records in some reverse zone
+                self.rrset_index = dict((key, value) for key, value in self.rrset_index.items() if value is index)
+            if index is None:
+                continue
+            key = (rrset['name'], rrset['type'])
+            if rrset['changetype'] == 'DELETE':
+                index.pop(key, None)
+            else:
+                index[key] = dict(name=rrset['name'], type=rrset['type'], ttl=rrset['ttl'],
+                                  records=[dict(content=record['content'], disabled=record['disabled'])
+                                           for record in rrset['records']])
 
+    def get_record(self, server, zone, name, rtype, refresh=False):
+        """Search for a given record (name) in the specified zone."""
         # Canonicalize record name and zone
         canonical_name = self._make_canonical(name)
-        canonical_zone = self._make_canonical(zone)
 
-        # Convert search result response to RRSet object
-        rrset = dict(records=[], comments=[])
-
-        for record in resp:
-            if record['object_type'] != 'record' or record['type'] != rtype:
-                continue
+        if refresh:
+            self._forget_zone(server, zone)
 
-            if record['name'] == canonical_name and record['zone'] == canonical_zone:
-
-                if 'name' not in rrset:
-                    rrset['name'] = record['name']
-                if 'type' not in rrset:
-                    rrset['type'] = record['type']
-                if 'ttl' not in rrset:
-                    rrset['ttl'] = record['ttl']
+        if self.rrset_filter:
+            found = self._get_filtered_rrset(server, zone, canonical_name, rtype)
+        else:
+            index = self.get_rrset_index(server, zone)
+            found = index.get((canonical_name, rtype)) if index else None
 
+        # Convert the rrset of the zone to RRSet object
+        rrset = dict(records=[], comments=[])
+        if found and found.get('records'):
+            rrset['name'] = found['name']
+            rrset['type'] = found['type']
+            rrset['ttl'] = found['ttl']
+            for record in found['records']:
                 rrentry = dict(content=record['content'],
                                disabled=record['disabled'])
                 rrset['records'].append(rrentry)
@@ -219,8 +378,6 @@ class PowerDNSClient:
         return data
 
     def create_record(self, server, zone, name, rtype, content, disabled, ttl, set_ptr):
-        url = self._get_zone_url(server=server, name=zone)
-
         # Ensure record name is fully canonical
         canonical_name = self._make_canonical(name)
 
@@ -235,44 +392,38 @@ class PowerDNSClient:
             disabled=disabled,
             ttl=ttl
         )
-        req = self.session.patch(url=url, json=data)
-        return self._handle_request(req)
+        return self.patch_rrsets(server=server, zone=zone, rrsets=data['rrsets'])
+
+    def patch_rrsets(self, server, zone, rrsets):
+        url = self._get_zone_url(server=server, name=zone)
+        try:
+            req = self._request('PATCH', url, json=dict(rrsets=rrsets))
+            result = self._handle_request(req)
+        except Exception:
+            # the zone may be changed partially
+            self._forget_zone(server, zone)
+            raise
+        self._apply_to_index(server, zone, rrsets)
+        return result
 
     def delete_record(self, server, zone, name, rtype):
         canonical_name = self._make_canonical(name)
-        url = self._get_zone_url(server=server, name=zone)
         data = self._get_request_data(changetype='DELETE', server=server,
                                       zone=zone, name=canonical_name, rtype=rtype)
-        req = self.session.patch(url=url, json=data)
-        return self._handle_request(req)
-
+        return self.patch_rrsets(server=server, zone=zone, rrsets=data['rrsets'])
 
-def ensure(module, pdns_client):
-    content = module.params['content']
-    disabled = module.params['disabled']
-    exclusive = module.params['exclusive']
-    name = module.params['name']
-    rtype = module.params['type']
-    set_ptr = module.params['set_ptr']
-    ttl = module.params['ttl']
-    zone_name = module.params['zone']
-    server = module.params['server']
-    state = module.params['state']
 
+def qualify_name(name, zone_name):
     # Remove trailing periods on records
     # Will be added later during CRUD operations.
     if name.endswith('.'):
         name = name.rstrip('.')
-    if zone_name.endswith('.'):
-        zone_name = zone_name.rstrip('.')
-
     if zone_name not in name:
         name = '{name}.{zone}'.format(name=name, zone=zone_name)
+    return name
 
-    # Try to find the record by name and type
-    record = pdns_client.get_record(name=name, server=server, rtype=rtype, zone=zone_name)
-    existing_content = [c.get('content') for c in record["records"]]
 
+def sanitize_content(rtype, content):
     # Sanitize user-provided input for certain record types
     if content:
         if rtype == 'AAAA':
@@ -283,6 +434,48 @@ def ensure(module, pdns_client):
         # Ensure TXT records are double quoted
         if rtype == 'TXT' and not (content.startswith('"') and content.endswith('"')):
             content = '"{}"'.format(content.strip('"'))
+    return content
+
+
+def written_record(module, pdns_client, response, server, zone_name, name, rtype, content, ttl, disabled):
+    # PowerDNS answers 204 without body to a successful PATCH, the rrset is the one sent.
+    # Read it again when verify is requested or the server returned something else.
+    if not module.check_mode and (module.params['verify'] or response):
+        return pdns_client.get_record(server=server, rtype=rtype, zone=zone_name, name=name, refresh=True)
+    rrset = dict(records=[], comments=[])
+    if content:
+        rrset['name'] = pdns_client._make_canonical(name)
+        rrset['type'] = rtype
+        rrset['ttl'] = ttl
+        rrset['records'] = [dict(content=c, disabled=disabled) for c in content]
+    return rrset
+
+
+def ensure(module, pdns_client):
+    content = module.params['content']
+    disabled = module.params['disabled']
+    exclusive = module.params['exclusive']
+    name = module.params['name']
+    rtype = module.params['type']
+    set_ptr = module.params['set_ptr']
+    ttl = module.params['ttl']
+    zone_name = module.params['zone']
+    server = module.params['server']
+    state = module.params['state']
+
+    if zone_name.endswith('.'):
+        zone_name = zone_name.rstrip('.')
+    name = qualify_name(name, zone_name)
+
+    # Try to find the record by name and type
+    try:
+        record = pdns_client.get_record(name=name, server=server, rtype=rtype, zone=zone_name)
+    except PowerDNSError as e:
+        module.fail_json(
+                msg='Could not get record {name}: HTTP {code}: {err}'.format(name=name, code=e.status_code, err=e.message))
+    existing_content = [c.get('content') for c in record["records"]]
+
+    content = sanitize_content(rtype, content)
 
     if state == 'present':
         record_content = []
@@ -291,10 +484,11 @@ def ensure(module, pdns_client):
         if not existing_content:
             record_content.append(content)
             try:
+                response = None
                 if not module.check_mode:
-                    pdns_client.create_record(server=server, zone=zone_name, name=name, rtype=rtype, content=record_content,
-                                              set_ptr=set_ptr, ttl=ttl, disabled=disabled)
-                return True, pdns_client.get_record(server=server, rtype=rtype, zone=zone_name, name=name)
+                    response = pdns_client.create_record(server=server, zone=zone_name, name=name, rtype=rtype, content=record_content,
+                                                         set_ptr=set_ptr, ttl=ttl, disabled=disabled)
+                return True, written_record(module, pdns_client, response, server, zone_name, name, rtype, record_content, ttl, disabled)
             except PowerDNSError as e:
                 module.fail_json(
                         msg='Could not create record {name}: HTTP {code}: {err}'.format(name=name, code=e.status_code,
@@ -309,10 +503,11 @@ def ensure(module, pdns_client):
                 record_content = record_content + existing_content
 
             try:
+                response = None
                 if not module.check_mode:
-                    pdns_client.create_record(server=server, zone=zone_name, name=name, rtype=rtype, content=record_content,
-                                              set_ptr=set_ptr, ttl=ttl, disabled=disabled)
-                return True, pdns_client.get_record(server=server, rtype=rtype, zone=zone_name, name=name)
+                    response = pdns_client.create_record(server=server, zone=zone_name, name=name, rtype=rtype, content=record_content,
+                                                         set_ptr=set_ptr, ttl=ttl, disabled=disabled)
+                return True, written_record(module, pdns_client, response, server, zone_name, name, rtype, record_content, ttl, disabled)
             except PowerDNSError as e:
                 module.fail_json(
                         msg='Could not update record {name}: HTTP {code}: {err}'.format(name=name, code=e.status_code,
@@ -334,10 +529,11 @@ def ensure(module, pdns_client):
             record_content = existing_content
 
             try:
+                response = None
                 if not module.check_mode:
-                    pdns_client.create_record(server=server, zone=zone_name, name=name, rtype=rtype, content=record_content,
-                                          set_ptr=set_ptr, ttl=ttl, disabled=disabled)
-                return True, pdns_client.get_record(server=server, rtype=rtype, zone=zone_name, name=name)
+                    response = pdns_client.create_record(server=server, zone=zone_name, name=name, rtype=rtype, content=record_content,
+                                                         set_ptr=set_ptr, ttl=ttl, disabled=disabled)
+                return True, written_record(module, pdns_client, response, server, zone_name, name, rtype, record_content, ttl, disabled)
             except PowerDNSError as e:
                 module.fail_json(
                         msg='Could not delete record {name}: HTTP {code}: {err}'.format(name=name, code=e.status_code,
@@ -354,13 +550,142 @@ def ensure(module, pdns_client):
     return False, record
 
 
+def reverse_zone_of(address, reverse_zones):
+    reverse_name = ipaddress.ip_address(address).reverse_pointer + '.'
+    # the most specific reverse zone holds the PTR
+    matched = [zone for zone in reverse_zones if reverse_name.endswith('.' + zone)]
+    if not matched:
+        return reverse_name, None
+    return reverse_name, max(matched, key=len)
+
+
+def build_ptr_changes(module, pdns_client, changes):
+    """Group PTR rrsets of the A/AAAA rrsets to write by reverse zone."""
+    server = module.params['server']
+    reverse_zones = [zone['name'] for zone in pdns_client.get_zones(server)
+                     if zone['name'].endswith('.in-addr.arpa.') or zone['name'].endswith('.ip6.arpa.')]
+    ptr_changes = dict()
+    for change in changes:
+        if change['type'] not in ['A', 'AAAA'] or change['changetype'] != 'REPLACE':
+            continue
+        for record in change['records']:
+            reverse_name, reverse_zone = reverse_zone_of(record['content'], reverse_zones)
+            if reverse_zone is None:
+                module.fail_json(msg='No reverse zone for {address} of {name}'.format(address=record['content'],
+                                                                                    name=change['name']))
+            # keyed by name, an address written twice gets the PTR of the last one as set-ptr does
+            ptr_changes.setdefault(reverse_zone, dict())[reverse_name] = dict(
+                    name=reverse_name, type='PTR', changetype='REPLACE', ttl=change['ttl'],
+                    records=[dict(content=change['name'], disabled=record['disabled'])])
+    return dict((zone, list(rrsets.values())) for zone, rrsets in ptr_changes.items())
+
+
+def patch_zones(module, pdns_client, patches):
+    """Send the PATCH of each zone concurrently."""
+    server = module.params['server']
+    executor = ThreadPoolExecutor(max_workers=max(min(len(patches), module.params['pdns_pool_size']), 1))
+    futures = [(zone, executor.submit(pdns_client.patch_rrsets, server=server, zone=zone, rrsets=rrsets))
+               for zone, rrsets in patches]
+    try:
+        for zone, future in futures:
+            try:
+                future.result()
+            except PowerDNSError as e:
+                module.fail_json(
+                        msg='Could not update rrsets of zone {name}: HTTP {code}: {err}'.format(name=zone, code=e.status_code,
+                                                                                              err=e.message))
+    finally:
+        executor.shutdown(wait=True)
+
+
+def ensure_rrsets(module, pdns_client):
+    server = module.params['server']
+    set_ptr = module.params['set_ptr']
+    batch_ptr = set_ptr and module.params['batch_ptr']
+    zone_name = module.params['zone'].rstrip('.')
+    canonical_zone = zone_name + '.'
+
+    try:
+        existing = pdns_client.get_rrset_index(server, zone_name)
+    except PowerDNSError as e:
+        module.fail_json(
+                msg='Could not get zone {name}: HTTP {code}: {err}'.format(name=zone_name, code=e.status_code, err=e.message))
+    if existing is None:
+        module.fail_json(msg='Zone {name} does not exist'.format(name=zone_name))
+
+    changes = []
+    desired = set()
+    for item in module.params['rrsets']:
+        rtype = item['type']
+        name = qualify_name(item['name'], zone_name) + '.'
+        key = (name, rtype)
+        desired.add(key)
+        current = existing.get(key)
+        state = item['state'] or module.params['state']
+        if state == 'absent':
+            if current is not None:
+                changes.append(dict(name=name, type=rtype, changetype='DELETE', records=[]))
+            continue
+        ttl = item['ttl'] if item['ttl'] is not None else module.params['ttl']
+        disabled = item['disabled'] if item['disabled'] is not None else module.params['disabled']
+        content = [sanitize_content(rtype, c) for c in item['content'] or []]
+        if current is not None and current.get('ttl') == ttl and sorted(
+                (r['content'], r['disabled']) for r in current['records']) == sorted((c, disabled) for c in content):
+            continue
+        records = []
+        for c in content:
+            entry = dict(content=c, disabled=disabled)
+            if rtype in ['A', 'AAAA'] and set_ptr and not batch_ptr:
+                entry['set-ptr'] = True
+            records.append(entry)
+        changes.append(dict(name=name, type=rtype, changetype='REPLACE', ttl=ttl, records=records))
+
+    if module.params['purge']:
+        for key in sorted(existing):
+            name, rtype = key
+            if key in desired or rtype == 'SOA' or (rtype == 'NS' and name == canonical_zone):
+                continue
+            changes.append(dict(name=name, type=rtype, changetype='DELETE', records=[]))
+
+    ptr_changes = dict()
+    if batch_ptr and changes:
+        try:
+            ptr_changes = build_ptr_changes(module, pdns_client, changes)
+        except PowerDNSError as e:
+            module.fail_json(
+                    msg='Could not get zones: HTTP {code}: {err}'.format(code=e.status_code, err=e.message))
+
+    if changes and not module.check_mode:
+        forward_changes = changes
+        patches = []
+        for reverse_zone in sorted(ptr_changes):
+            if reverse_zone == canonical_zone:
+                # PTR in the zone itself goes with the forward changes
+                forward_changes = changes + ptr_changes[reverse_zone]
+            else:
+                patches.append((reverse_zone, ptr_changes[reverse_zone]))
+        patches.insert(0, (zone_name, forward_changes))
+        patch_zones(module, pdns_client, patches)
+    return len(changes) > 0, changes, ptr_changes
+
+
 def main():
     module = AnsibleModule(
             argument_spec=dict(
                     content=dict(type='str', required=False),
                     exclusive=dict(type='bool', default=True),
                     disabled=dict(type='bool', default=False),
-                    name=dict(type='str', required=True),
+                    name=dict(type='str', required=False),
+                    rrsets=dict(type='list', elements='dict', required=False, options=dict(
+                            name=dict(type='str', required=True),
+                            type=dict(type='str', required=True, choices=['A', 'AAAA', 'CNAME', 'MX', 'PTR', 'SOA', 'SRV', 'TXT', 'LUA', 'NS']),
+                            content=dict(type='list', elements='str', required=False),
+                            ttl=dict(type='int', required=False),
+                            disabled=dict(type='bool', required=False),
+                            state=dict(type='str', required=False, choices=['present', 'absent']),
+                    )),
+                    purge=dict(type='bool', default=False),
+                    batch_ptr=dict(type='bool', default=False),
                     server=dict(type='str', default='localhost'),
                     set_ptr=dict(type='bool', default=False),
                     state=dict(type='str', default='present', choices=['present', 'absent']),
@@ -372,8 +697,17 @@ def main():
                     pdns_prot=dict(type='str', default='http', choices=['http', 'https']),
                     pdns_api_key=dict(type='str', required=False),
                     strict_ssl_checking=dict(type='bool', default=True),
+                    pdns_pool_size=dict(type='int', default=10),
+                    pdns_connect_timeout=dict(type='float', default=5),
+                    pdns_read_timeout=dict(type='float', default=30),
+                    pdns_retries=dict(type='int', default=3),
+                    pdns_backoff_factor=dict(type='float', default=0.5),
+                    rrset_filter=dict(type='bool', default=False),
+                    verify=dict(type='bool', default=False),
             ),
             supports_check_mode=True,
+            required_one_of=[('name', 'rrsets')],
+            mutually_exclusive=[('name', 'rrsets')],
     )
 
     if not HAS_REQUESTS:
@@ -383,11 +717,20 @@ def main():
                                  port=module.params['pdns_port'],
                                  prot=module.params['pdns_prot'],
                                  api_key=module.params['pdns_api_key'],
-                                 verify=module.params['strict_ssl_checking'])
+                                 verify=module.params['strict_ssl_checking'],
+                                 pool_size=module.params['pdns_pool_size'],
+                                 connect_timeout=module.params['pdns_connect_timeout'],
+                                 read_timeout=module.params['pdns_read_timeout'],
+                                 retries=module.params['pdns_retries'],
+                                 backoff_factor=module.params['pdns_backoff_factor'],
+                                 rrset_filter=module.params['rrset_filter'])
 
     try:
+        if module.params['rrsets'] is not None:
+            changed, rrsets, ptr_rrsets = ensure_rrsets(module, pdns_client)
+            module.exit_json(changed=changed, rrsets=rrsets, ptr_rrsets=ptr_rrsets, metrics=pdns_client.metrics())
         changed, record = ensure(module, pdns_client)
-        module.exit_json(changed=changed, record=record)
+        module.exit_json(changed=changed, record=record, metrics=pdns_client.metrics())
     except Exception as e:
         module.fail_json(msg='Error: {0}'.format(str(e)))
 
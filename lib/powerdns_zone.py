@@ -46,6 +46,33 @@ options:
     description:
     - Disables strict certificate checking
     default: true
+  pdns_pool_size:
+    description:
+    - Number of keep-alive connections kept to PowerDNS API
+    required: false
+    default: 10
+  pdns_connect_timeout:
+    description:
+    - Timeout in seconds to connect to PowerDNS API
+    required: false
+    default: 5
+  pdns_read_timeout:
+    description:
+    - Timeout in seconds to wait for a response of PowerDNS API
+    required: false
+    default: 30
+  pdns_retries:
+    description:
+    - >
+      Number of retries of a request on connection errors and 5xx responses.
+      POST is not retried.
+    required: false
+    default: 3
+  pdns_backoff_factor:
+    description:
+    - Backoff factor of the retries, the retries wait backoff_factor * 2 ** (retry count - 1) seconds
+    required: false
+    default: 0.5
 author: "Thomas Krahn (@nosmoht)"
 '''
 
@@ -70,12 +97,20 @@ EXAMPLES = '''
     pdns_api_key: topsecret
 '''
 
+import time
+
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     HAS_REQUESTS = True
 except ImportError:
     HAS_REQUESTS = False
 
+# methods retried on connection errors and 5xx responses, PATCH sets zone metadata to absolute values
+# and a repeated DELETE of a removed zone is handled in delete_zone
+RETRY_METHODS = frozenset(['HEAD', 'GET', 'PUT', 'DELETE', 'OPTIONS', 'PATCH'])
+
 
 class PowerDNSError(Exception):
     def __init__(self, url, status_code, message):
@@ -85,12 +120,41 @@ class PowerDNSError(Exception):
         super(PowerDNSError, self).__init__()
 
 
+def build_retry(retries, backoff_factor):
+    kwargs = dict(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff_factor,
+                  status_forcelist=[500, 502, 503, 504], raise_on_status=False)
+    try:
+        return Retry(allowed_methods=RETRY_METHODS, **kwargs)
+    except TypeError:
+        # urllib3 older than 1.26
+        return Retry(method_whitelist=RETRY_METHODS, **kwargs)
+
+
 class PowerDNSClient:
-    def __init__(self, host, port, prot, api_key, verify):
+    def __init__(self, host, port, prot, api_key, verify, pool_size=10, connect_timeout=5,
+                 read_timeout=30, retries=3, backoff_factor=0.5):
         self.url = '{prot}://{host}:{port}/api/v1'.format(prot=prot, host=host, port=port)
         self.session = requests.Session()
         self.session.headers.update({'X-API-Key': api_key})
         self.session.verify = verify
+        # keep-alive connections are reused by all requests of the task
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=build_retry(retries, backoff_factor))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.latencies = list()
+
+    def _request(self, method, url, **kwargs):
+        start = time.time()
+        req = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        self.latencies.append(dict(method=method, url=url, status=req.status_code,
+                                   seconds=round(time.time() - start, 6)))
+        return req
+
+    def metrics(self):
+        return dict(requests=self.latencies, count=len(self.latencies),
+                    seconds=round(sum(latency['seconds'] for latency in self.latencies), 6))
 
     def _handle_request(self, req):
         if req.status_code in [200, 201, 204]:
@@ -130,21 +194,23 @@ class PowerDNSClient:
         return '{url}/{name}'.format(url=self._get_zones_url(server), name=name)
 
     def get_zone(self, server, name):
-        req = self.session.get(url=self._get_zone_url(server, name))
+        req = self._request('GET', self._get_zone_url(server, name))
         if req.status_code == 422 or req.status_code == 404:  # zone does not exist
             return None
         return self._handle_request(req)
 
     def create_zone(self, server, data):
-        req = self.session.post(url=self._get_zones_url(server), json=data)
+        req = self._request('POST', self._get_zones_url(server), json=data)
         return self._handle_request(req)
 
     def delete_zone(self, server, name):
-        req = self.session.delete(url=self._get_zone_url(server, name))
+        req = self._request('DELETE', self._get_zone_url(server, name))
+        if req.status_code == 422 or req.status_code == 404:  # already deleted, e.g. by a retried request
+            return dict()
         return self._handle_request(req)
 
     def update_zone(self, server, zone):
-        req = self.session.patch(url=self._get_zone_url(server=server, name=zone.get('name')), data=zone)
+        req = self._request('PATCH', self._get_zone_url(server=server, name=zone.get('name')), data=zone)
         return self._handle_request(req)
 
 
@@ -172,7 +238,7 @@ def ensure(module, pdns_client):
             try:
                 zone = dict(name=name, kind=kind, nameservers=nameservers, masters=masters)
                 if module.check_mode:
-                    module.exit_json(changed=True, zone=zone)
+                    module.exit_json(changed=True, zone=zone, metrics=pdns_client.metrics())
                 pdns_client.create_zone(server, zone)
                 return True, pdns_client.get_zone(server, name)
             except PowerDNSError as e:
@@ -183,7 +249,7 @@ def ensure(module, pdns_client):
         if state == 'absent':
             try:
                 if module.check_mode:
-                    module.exit_json(changed=True, zone=zone)
+                    module.exit_json(changed=True, zone=zone, metrics=pdns_client.metrics())
                 pdns_client.delete_zone(server, name)  # zone.get('id'))
                 return True, None
             except PowerDNSError as e:
@@ -219,6 +285,11 @@ def main():
             pdns_prot=dict(type='str', default='http', choices=['http', 'https']),
             pdns_api_key=dict(type='str', required=False),
             strict_ssl_checking=dict(type='bool', default=True),
+            pdns_pool_size=dict(type='int', default=10),
+            pdns_connect_timeout=dict(type='float', default=5),
+            pdns_read_timeout=dict(type='float', default=30),
+            pdns_retries=dict(type='int', default=3),
+            pdns_backoff_factor=dict(type='float', default=0.5),
         ),
         supports_check_mode=True,
     )
@@ -230,11 +301,16 @@ def main():
                                  port=module.params['pdns_port'],
                                  prot=module.params['pdns_prot'],
                                  api_key=module.params['pdns_api_key'],
-                                 verify=module.params['strict_ssl_checking'])
+                                 verify=module.params['strict_ssl_checking'],
+                                 pool_size=module.params['pdns_pool_size'],
+                                 connect_timeout=module.params['pdns_connect_timeout'],
+                                 read_timeout=module.params['pdns_read_timeout'],
+                                 retries=module.params['pdns_retries'],
+                                 backoff_factor=module.params['pdns_backoff_factor'])
 
     try:
         changed, zone = ensure(module, pdns_client)
-        module.exit_json(changed=changed, zone=zone)
+        module.exit_json(changed=changed, zone=zone, metrics=pdns_client.metrics())
     except Exception as e:
         module.fail_json(msg='Error: {0}'.format(str(e)))
 